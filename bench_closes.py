@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark for close/change processing: the original per-ticker loop
+versus the vectorized pipeline.process_closes, as the universe grows.
+
+Usage: python3 bench_closes.py [--sizes 220 500 1000 3000 6000] [--days 5]
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from pipeline import process_closes
+
+
+def process_closes_loop(data, tickers):
+    """The original implementation, kept here as the baseline"""
+    results = {}
+    for yf_ticker in tickers:
+        try:
+            if len(tickers) == 1:
+                ticker_data = data
+            else:
+                ticker_data = data[yf_ticker] if yf_ticker in data.columns.get_level_values(0) else None
+
+            if ticker_data is not None and not ticker_data.empty:
+                closes = ticker_data['Close'].dropna()
+                if len(closes) >= 2:
+                    current_price = closes.iloc[-1]
+                    prev_close = closes.iloc[-2]
+                    change_pct = ((current_price - prev_close) / prev_close) * 100
+                    results[yf_ticker] = {
+                        'price': float(current_price),
+                        'change': float(change_pct),
+                        'marketCap': None
+                    }
+        except Exception:
+            pass
+    return results
+
+
+def make_download(size, days, nan_rate, seed=0):
+    """A frame shaped like yf.download(..., group_by='ticker') with some gaps"""
+    rng = np.random.default_rng(seed)
+    tickers = [f"T{i:05d}" for i in range(size)]
+    index = pd.bdate_range(end="2026-01-16", periods=days)
+    close = 100 * np.cumprod(1 + rng.normal(0, 0.02, size=(days, size)), axis=0)
+    close[rng.random((days, size)) < nan_rate] = np.nan
+    fields = ['Open', 'High', 'Low', 'Close', 'Volume']
+    columns = pd.MultiIndex.from_product([tickers, fields])
+    values = np.repeat(close[:, :, None], len(fields), axis=2).reshape(days, size * len(fields))
+    return pd.DataFrame(values, index=index, columns=columns), tickers
+
+
+def best_of(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[220, 500, 1000, 3000, 6000])
+    parser.add_argument('--days', type=int, default=5)
+    parser.add_argument('--nan-rate', type=float, default=0.05)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'tickers':>8}{'loop':>12}{'vectorized':>12}{'speedup':>10}")
+    print("-" * 42)
+    for size in args.sizes:
+        data, tickers = make_download(size, args.days, args.nan_rate)
+        loop_time, expected = best_of(lambda: process_closes_loop(data, tickers), args.repeat)
+        vec_time, (results, _) = best_of(lambda: process_closes(data, tickers), args.repeat)
+
+        # Both must agree before the numbers mean anything
+        assert results.keys() == expected.keys(), "ticker sets differ"
+        for t, r in expected.items():
+            assert abs(results[t]['price'] - r['price']) < 1e-9
+            assert abs(results[t]['change'] - r['change']) < 1e-9
+
+        print(f"{size:>8}{loop_time * 1000:>10.1f}ms{vec_time * 1000:>10.1f}ms{loop_time / vec_time:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
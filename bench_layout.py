@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Parity check and timing for layout.treemap_layout, the server-side port of
+the d3.treemap layout that index.html's computeLayout() draws without a
+server.
+
+The check lays out a small fixed tree and compares every rectangle and label
+against EXPECTED, worked out step by step from d3-hierarchy's squarify tiling,
+positionNode padding and roundNode rounding with the page's settings. The
+tree covers a broken squarify row, dice and slice rows, a zero-cap stock,
+a rounded half pixel and a truncated sector label. Timings follow for
+synthetic snapshots of growing size.
+
+Usage: python3 bench_layout.py [--sizes 500 3000] [--repeat 5]
+"""
+
+import argparse
+import time
+
+from bench_snapshot import make_snapshot
+from layout import treemap_layout
+
+WIDTH, HEIGHT = 400, 300
+
+TREE = {
+    "name": "S&P 500",
+    "children": [
+        {"name": "Communication Services", "children": [
+            {"ticker": "DDD", "name": "D", "marketCap": 400, "price": 1.0, "change": 0.5},
+            {"ticker": "EEE", "name": "E", "marketCap": 100, "price": 1.0, "change": None},
+            {"ticker": "FFF", "name": "F", "marketCap": 0, "price": 1.0, "change": 0.1},
+        ]},
+        {"name": "Technology", "children": [
+            {"ticker": "CCC", "name": "C", "marketCap": 200, "price": 1.0, "change": -1.0},
+            {"ticker": "AAA", "name": "A", "marketCap": 500, "price": 1.0, "change": 1.0},
+            {"ticker": "BBB", "name": "B", "marketCap": 300, "price": 1.0, "change": 0.0},
+        ]},
+    ]
+}
+
+# What d3.treemap().size([400, 300]).paddingOuter(3).paddingTop(19).paddingInner(1).round(true)
+# gives for TREE, in computeLayout()'s shape (tickerSize/changeSize rounded to 0.1)
+EXPECTED = {
+    "width": WIDTH,
+    "height": HEIGHT,
+    "sectors": [
+        {"name": "Technology", "label": "Technology", "x": 3, "y": 19, "w": 262, "h": 278},
+        {"name": "Communication Services", "label": "Communicati...", "x": 266, "y": 19, "w": 131, "h": 278},
+    ],
+    "nodes": [
+        {"ticker": "AAA", "sector": "Technology", "x": 6, "y": 38, "w": 205, "h": 160,
+         "tickerSize": 14, "changeSize": 11, "showTicker": True, "showChange": True},
+        {"ticker": "BBB", "sector": "Technology", "x": 6, "y": 199, "w": 205, "h": 95,
+         "tickerSize": 14, "changeSize": 11, "showTicker": True, "showChange": True},
+        {"ticker": "CCC", "sector": "Technology", "x": 212, "y": 38, "w": 50, "h": 256,
+         "tickerSize": 10.0, "changeSize": 8.3, "showTicker": True, "showChange": True},
+        {"ticker": "DDD", "sector": "Communication Services", "x": 269, "y": 38, "w": 125, "h": 205,
+         "tickerSize": 14, "changeSize": 11, "showTicker": True, "showChange": True},
+        {"ticker": "EEE", "sector": "Communication Services", "x": 269, "y": 244, "w": 125, "h": 50,
+         "tickerSize": 14, "changeSize": 11, "showTicker": True, "showChange": False},
+        {"ticker": "FFF", "sector": "Communication Services", "x": 395, "y": 244, "w": 0, "h": 50,
+         "tickerSize": 8, "changeSize": 7, "showTicker": False, "showChange": False},
+    ]
+}
+
+
+def check_parity():
+    """Compare treemap_layout(TREE) against EXPECTED, listing every difference"""
+    layout = treemap_layout(TREE, WIDTH, HEIGHT)
+    differences = []
+    for key in ('width', 'height'):
+        if layout[key] != EXPECTED[key]:
+            differences.append(f"{key}: {layout[key]} != {EXPECTED[key]}")
+    for kind, id_key in (('sectors', 'name'), ('nodes', 'ticker')):
+        got = [item[id_key] for item in layout[kind]]
+        want = [item[id_key] for item in EXPECTED[kind]]
+        if got != want:
+            differences.append(f"{kind} order: {got} != {want}")
+            continue
+        for item, expected in zip(layout[kind], EXPECTED[kind]):
+            for key, value in expected.items():
+                if item.get(key) != value:
+                    differences.append(f"{item[id_key]}.{key}: {item.get(key)!r} != {value!r}")
+    return differences
+
+
+def best_of(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[500, 3000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    # The layout must match d3 before the numbers mean anything
+    differences = check_parity()
+    if differences:
+        print("treemap_layout differs from d3.treemap:")
+        for line in differences:
+            print(f"  {line}")
+        raise SystemExit(1)
+    print(f"treemap_layout matches d3.treemap on the reference tree ({len(EXPECTED['nodes'])} nodes)\n")
+
+    print(f"{'tickers':>8}{'1280x800':>12}{'3840x2160':>12}")
+    print("-" * 32)
+    for size in args.sizes:
+        data = make_snapshot(size)
+        small = best_of(lambda: treemap_layout(data, 1280, 800), args.repeat)
+        large = best_of(lambda: treemap_layout(data, 3840, 2160), args.repeat)
+        print(f"{size:>8}{small * 1000:>10.1f}ms{large * 1000:>10.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Benchmark the market-cap stage against a fake provider with simulated latency.
+Compares the old serial loop with the concurrent fetch engine, no network needed.
+
+Usage: python3 bench_market_caps.py [--tickers 220] [--latency 0.15] [--workers 4 16 32]
+"""
+
+import argparse
+import random
+import time
+
+from market_caps import fetch_market_caps
+
+
+def make_fake_fetch(latency, jitter, error_rate, seed=0):
+    """Return a fetch_one() that sleeps like a network call and returns a fake cap"""
+    rng = random.Random(seed)
+
+    def fetch_one(ticker):
+        time.sleep(max(0.0, latency + rng.uniform(-jitter, jitter)))
+        if rng.random() < error_rate:
+            raise ConnectionError(f"simulated failure for {ticker}")
+        return rng.uniform(10, 3000)
+
+    return fetch_one
+
+
+def serial_fetch(tickers, fetch_one):
+    """The original one-at-a-time loop"""
+    caps = {}
+    for t in tickers:
+        try:
+            value = fetch_one(t)
+            if value:
+                caps[t] = value
+        except Exception:
+            pass
+    return caps
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--tickers', type=int, default=220)
+    parser.add_argument('--latency', type=float, default=0.15, help="mean seconds per lookup")
+    parser.add_argument('--jitter', type=float, default=0.05)
+    parser.add_argument('--error-rate', type=float, default=0.02)
+    parser.add_argument('--timeout', type=float, default=10.0)
+    parser.add_argument('--workers', type=int, nargs='+', default=[4, 16, 32])
+    parser.add_argument('--skip-serial', action='store_true', help="don't run the slow serial baseline")
+    args = parser.parse_args()
+
+    tickers = [f"T{i:04d}" for i in range(args.tickers)]
+    print(f"{args.tickers} tickers, {args.latency * 1000:.0f}ms +/- {args.jitter * 1000:.0f}ms latency, "
+          f"{args.error_rate:.0%} errors")
+    print("=" * 50)
+
+    serial_time = None
+    if not args.skip_serial:
+        fetch_one = make_fake_fetch(args.latency, args.jitter, args.error_rate)
+        start = time.perf_counter()
+        caps = serial_fetch(tickers, fetch_one)
+        serial_time = time.perf_counter() - start
+        print(f"  serial        {serial_time:8.2f}s  {len(caps)} caps")
+
+    for workers in args.workers:
+        fetch_one = make_fake_fetch(args.latency, args.jitter, args.error_rate)
+        start = time.perf_counter()
+        caps, errors = fetch_market_caps(tickers, fetch_one, max_workers=workers, timeout=args.timeout)
+        elapsed = time.perf_counter() - start
+        speedup = f"  {serial_time / elapsed:5.1f}x" if serial_time else ""
+        print(f"  workers={workers:<4}  {elapsed:8.2f}s  {len(caps)} caps, {len(errors)} errors{speedup}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Time each stage of the refresh pipeline against the synthetic provider.
+Stages: download, close processing, market caps, output build, JSON write.
+
+Usage: python3 bench_refresh.py [--sizes 220 500 3000] [--latency 0.0] [--cap-latency 0.05]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from market_caps import fetch_market_caps
+from pipeline import process_closes, build_output, write_output
+from providers import SyntheticProvider
+from universe import Universe
+
+STAGES = ["download", "closes", "caps", "build", "write"]
+
+
+def run_once(size, latency, cap_latency, error_rate, workers, out_path):
+    """Run the pipeline once and return {stage: seconds}"""
+    provider = SyntheticProvider(latency=latency, error_rate=error_rate, universe_size=size)
+    stocks = provider.universe()
+    indices = ["SPY", "QQQ"]
+    timings = {}
+
+    all_tickers = Universe(stocks, indices).symbols()
+
+    start = time.perf_counter()
+    data = provider.download(all_tickers, period='5d')
+    timings["download"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    results, _ = process_closes(data, all_tickers)
+    timings["closes"] = time.perf_counter() - start
+
+    provider.latency = cap_latency
+    stock_tickers = [t for t in all_tickers if t not in indices and t in results]
+    start = time.perf_counter()
+    caps, _ = fetch_market_caps(stock_tickers, provider.market_cap, max_workers=workers)
+    for t, cap in caps.items():
+        results[t]['marketCap'] = cap
+    timings["caps"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    output = build_output(stocks, indices, results)
+    timings["build"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    write_output(output, out_path)
+    timings["write"] = time.perf_counter() - start
+
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[220, 500, 3000])
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds per batch download")
+    parser.add_argument('--cap-latency', type=float, default=0.05, help="seconds per market-cap lookup")
+    parser.add_argument('--error-rate', type=float, default=0.01)
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--repeat', type=int, default=3, help="runs per size, best time is kept")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        out_path = os.path.join(tmp, "sp500_data.json")
+        print(f"{'tickers':>8}" + ''.join(f"{s:>11}" for s in STAGES) + f"{'total':>11}")
+        print("-" * (8 + 11 * (len(STAGES) + 1)))
+        for size in args.sizes:
+            best = {}
+            for _ in range(args.repeat):
+                timings = run_once(size, args.latency, args.cap_latency, args.error_rate,
+                                   args.workers, out_path)
+                for stage, elapsed in timings.items():
+                    best[stage] = min(best.get(stage, elapsed), elapsed)
+            row = ''.join(f"{best[s] * 1000:9.1f}ms" for s in STAGES)
+            print(f"{size:>8}{row}{sum(best.values()) * 1000:9.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Load test for server.py: an in-process server with a fixed snapshot and a
+synthetic quote provider, driven by a configurable mix of clients fetching
+static files, downloading sp500_data.json, polling /api/status and storming
+/api/refresh. Reports throughput, p50/p95/p99 latency and error rates per
+request type, optionally as JSON for comparing runs.
+
+Usage: python3 bench_server.py [--mix polling|downloads|static|storm|mixed]
+                               [--pollers N] [--downloaders N] [--static N] [--refreshers N]
+                               [--duration 10] [--server threaded|single] [--workers 256]
+                               [--json results.json] [--compare baseline.json]
+"""
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import shutil
+import socketserver
+import subprocess
+import tempfile
+import threading
+import time
+
+import server
+from providers import SyntheticProvider
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Named client mixes: clients per request type
+MIXES = {
+    "polling": {"pollers": 150, "downloaders": 5, "static": 0, "refreshers": 0},
+    "downloads": {"pollers": 0, "downloaders": 50, "static": 0, "refreshers": 0},
+    "static": {"pollers": 0, "downloaders": 0, "static": 50, "refreshers": 0},
+    "storm": {"pollers": 50, "downloaders": 5, "static": 0, "refreshers": 50},
+    "mixed": {"pollers": 100, "downloaders": 10, "static": 10, "refreshers": 10},
+}
+
+# Request type -> (path, default seconds between requests per client)
+ROUTES = {
+    "pollers": ("/api/status", 0.5),
+    "downloaders": ("/sp500_data.json", 0),
+    "static": ("/index.html", 0),
+    "refreshers": ("/api/refresh", 0.05),
+}
+
+
+class SingleThreadedHandler(server.Handler):
+    """The original one-connection-at-a-time setup, for comparison"""
+    protocol_version = 'HTTP/1.0'
+
+
+class Stats:
+    """Latencies, errors and refresh outcomes of one request type"""
+
+    def __init__(self):
+        self.latencies = []
+        self.errors = []
+        self.started = 0
+
+
+def start_server(kind, workers):
+    """Start a server on a free port in a background thread, returning it"""
+    if kind == 'single':
+        httpd = socketserver.TCPServer(("127.0.0.1", 0), SingleThreadedHandler)
+    else:
+        httpd = server.TreemapServer(("127.0.0.1", 0), server.Handler, workers=workers)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    return httpd
+
+
+def client_loop(port, path, interval, stop, stats):
+    """Request `path` every `interval` seconds over one keep-alive connection"""
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            conn.request("GET", path, headers={"Accept-Encoding": "gzip"})
+            resp = conn.getresponse()
+            body = resp.read()
+            if resp.status != 200:
+                stats.errors.append(resp.status)
+            stats.latencies.append(time.perf_counter() - start)
+            if b'"started"' in body:
+                stats.started += 1
+            if resp.will_close:
+                conn.close()
+        except Exception as e:
+            stats.errors.append(type(e).__name__)
+            conn.close()
+        if interval:
+            stop.wait(interval)
+    conn.close()
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def summarize(stats, clients, duration):
+    """Machine-readable results of one request type (latencies in milliseconds)"""
+    total = len(stats.latencies) + sum(1 for e in stats.errors if isinstance(e, str))
+    ms = lambda v: None if v is None else round(v * 1000, 3)
+    return {
+        "clients": clients,
+        "requests": total,
+        "throughput": round(len(stats.latencies) / duration, 2),
+        "p50_ms": ms(percentile(stats.latencies, 50)),
+        "p95_ms": ms(percentile(stats.latencies, 95)),
+        "p99_ms": ms(percentile(stats.latencies, 99)),
+        "errors": len(stats.errors),
+        "error_rate": round(len(stats.errors) / total, 4) if total else 0.0,
+        "refreshes_started": stats.started,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def fmt(value, unit=""):
+    return "      -" if value is None else f"{value:7.1f}{unit}"
+
+
+def print_report(results, baseline=None):
+    print(f"{results['server']} server, mix {results['mix']}, {results['duration']:.0f}s")
+    print("=" * 86)
+    print(f"  {'route':<18}{'clients':>8}{'req/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'errors':>8}{'refreshes':>11}")
+    for route, r in results["routes"].items():
+        print(f"  {route:<18}{r['clients']:>8}{r['throughput']:>10.1f}{fmt(r['p50_ms']):>9}{fmt(r['p95_ms']):>9}"
+              f"{fmt(r['p99_ms']):>9}{r['errors']:>8}{r['refreshes_started'] if route == '/api/refresh' else '':>11}")
+        old = (baseline or {}).get("routes", {}).get(route)
+        if old:
+            def delta(key):
+                if not old.get(key) or r.get(key) is None:
+                    return "       -"
+                return f"{(r[key] - old[key]) / old[key] * 100:+7.1f}%"
+            print(f"  {'  vs baseline':<18}{'':>8}{delta('throughput'):>10}{delta('p50_ms'):>9}{delta('p95_ms'):>9}"
+                  f"{delta('p99_ms'):>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test for server.py")
+    parser.add_argument('--mix', choices=sorted(MIXES), default='polling')
+    for kind, (path, interval) in ROUTES.items():
+        parser.add_argument(f'--{kind}', type=int, help=f"clients requesting {path} (overrides --mix)")
+        parser.add_argument(f'--{kind}-interval', type=float, default=interval,
+                            help=f"seconds between each client's {path} requests")
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--server', choices=['threaded', 'single'], default='threaded')
+    parser.add_argument('--workers', type=int, default=server.WORKERS)
+    parser.add_argument('--snapshot', default=os.path.join(HERE, server.DATA_FILE),
+                        help="dataset served (copied, never modified)")
+    parser.add_argument('--provider-latency', type=float, default=0.2,
+                        help="seconds per synthetic download/market-cap call during refreshes")
+    parser.add_argument('--json', metavar='FILE', help="also write the results as JSON ('-' for stdout)")
+    parser.add_argument('--compare', metavar='FILE', help="show changes against an earlier --json result")
+    args = parser.parse_args()
+
+    if args.json and args.json != '-':
+        args.json = os.path.abspath(args.json)
+    snapshot = os.path.abspath(args.snapshot)
+    cwd = os.getcwd()
+
+    clients = dict(MIXES[args.mix])
+    for kind in ROUTES:
+        if getattr(args, kind) is not None:
+            clients[kind] = getattr(args, kind)
+
+    # Run in a scratch directory holding copies of the page and snapshot, so
+    # refreshes write their data file and market-cap cache there
+    workdir = tempfile.mkdtemp(prefix='bench_server_')
+    shutil.copy(os.path.join(HERE, 'index.html'), workdir)
+    shutil.copy(snapshot, os.path.join(workdir, server.DATA_FILE))
+    os.chdir(workdir)
+
+    # Keep the console quiet during the run
+    server.Handler.log_message = lambda self, *a: None
+    server.PROVIDER = SyntheticProvider(latency=args.provider_latency)
+    server.HISTORY = None
+    server.SNAPSHOTS.load(server.DATA_FILE)
+
+    httpd = start_server(args.server, args.workers)
+    port = httpd.server_address[1]
+
+    stop = threading.Event()
+    stats = {kind: Stats() for kind in ROUTES}
+    threads = []
+    for kind, (path, _) in ROUTES.items():
+        for _ in range(clients[kind]):
+            t = threading.Thread(target=client_loop, daemon=True,
+                                 args=(port, path, getattr(args, f'{kind}_interval'), stop, stats[kind]))
+            t.start()
+            threads.append(t)
+
+    time.sleep(args.duration)
+    stop.set()
+    for t in threads:
+        t.join(timeout=30)
+    server.REFRESH.wait(timeout=60)
+    httpd.shutdown()
+    httpd.server_close()
+    os.chdir(cwd)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    results = {
+        "server": args.server,
+        "mix": args.mix,
+        "duration": args.duration,
+        "workers": args.workers,
+        "clients": clients,
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "routes": {ROUTES[kind][0]: summarize(stats[kind], clients[kind], args.duration)
+                   for kind in ROUTES if clients[kind]},
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    if args.json == '-':
+        print(json.dumps(results, indent=2))
+    else:
+        print_report(results, baseline)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(results, f, indent=2)
+            print(f"\nResults written to {args.json}")
+
+
+if __name__ == '__main__':
+    main()
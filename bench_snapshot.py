@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Snapshot size and parse time: the JSON tree as written to disk (indent=2),
+as served (compact) and in the columnar encoding, raw and gzipped.
+
+Parse times are for Python (json.loads vs columnar.decode, and
+columnar.decode_columns alone) and, when node is on the PATH, for the browser
+side (JSON.parse vs the decodeColumnar() shipped in index.html).
+
+Usage: python3 bench_snapshot.py [--sizes 500 3000] [--repeat 20]
+"""
+
+import argparse
+import gzip
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+
+import columnar
+from universe import Universe
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Times the shipped decoder against JSON.parse; argv: json file, columnar file, repeat
+NODE_SCRIPT = """
+const fs = require('fs');
+%s
+const [jsonFile, columnarFile, repeat] = process.argv.slice(2);
+const text = fs.readFileSync(jsonFile, 'utf8');
+const buf = fs.readFileSync(columnarFile);
+const buffer = buf.buffer.slice(buf.byteOffset, buf.byteOffset + buf.byteLength);
+const best = fn => {
+    let best = Infinity;
+    for (let i = 0; i < +repeat; i++) {
+        const start = process.hrtime.bigint();
+        fn();
+        best = Math.min(best, Number(process.hrtime.bigint() - start) / 1e6);
+    }
+    return best;
+};
+console.log(JSON.stringify({json: best(() => JSON.parse(text)), columnar: best(() => decodeColumnar(buffer))}));
+"""
+
+
+def make_snapshot(size, seed=0):
+    """A sp500_data.json tree of `size` stocks spread over the universe's sectors"""
+    rng = random.Random(seed)
+    stocks = list(Universe.load().by_ticker.values())
+    sectors = {}
+    for i in range(size):
+        ticker, name, sector = stocks[i % len(stocks)]
+        price = round(rng.uniform(5, 900), 2)
+        sectors.setdefault(sector, []).append({
+            "ticker": f"{ticker}{i // len(stocks) or ''}",
+            "name": name,
+            "marketCap": round(rng.lognormvariate(3.5, 1.2), 2),
+            "price": None if rng.random() < 0.01 else price,
+            "change": None if rng.random() < 0.01 else round(rng.gauss(0, 1.5), 2)
+        })
+    return {
+        "name": "S&P 500",
+        "lastUpdated": "2026-01-16T16:00:00",
+        "indices": {"SPY": {"name": "S&P 500", "changePercent": 0.42},
+                    "QQQ": {"name": "NASDAQ 100", "changePercent": 0.61}},
+        "children": [{"name": name, "children": children} for name, children in sectors.items()]
+    }
+
+
+def best_of(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def node_decoder():
+    """decodeColumnar() from index.html, or None if node isn't available"""
+    if not shutil.which('node'):
+        return None
+    with open(os.path.join(HERE, 'index.html')) as f:
+        match = re.search(r'^function decodeColumnar\(.*?^}$', f.read(), re.S | re.M)
+    return match and match.group(0)
+
+
+def node_times(decoder, body, encoded, repeat):
+    """Best JSON.parse and decodeColumnar times in node (milliseconds)"""
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = [os.path.join(tmp, name) for name in ('bench.js', 'data.json', 'data.col')]
+        for path, content in zip(paths, (NODE_SCRIPT % decoder, body, encoded)):
+            with open(path, 'wb') as f:
+                f.write(content.encode() if isinstance(content, str) else content)
+        out = subprocess.run(['node'] + paths + [str(repeat)], capture_output=True, text=True, check=True)
+    return json.loads(out.stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[500, 3000])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    decoder = node_decoder()
+
+    for size in args.sizes:
+        data = make_snapshot(size)
+        on_disk = json.dumps(data, indent=2).encode()
+        compact = json.dumps(data, separators=(',', ':')).encode()
+        encoded = columnar.encode(data)
+        assert columnar.decode(encoded) == data, "columnar round trip differs"
+
+        print(f"\n{size} tickers")
+        print("=" * 60)
+        print(f"  {'format':<22}{'bytes':>10}{'gzip':>10}{'vs disk':>10}")
+        for label, body in (("json (indent=2, disk)", on_disk), ("json (compact)", compact),
+                            ("columnar", encoded)):
+            zipped = len(gzip.compress(body, compresslevel=6, mtime=0))
+            print(f"  {label:<22}{len(body):>10,}{zipped:>10,}{len(body) / len(on_disk):>9.0%}")
+
+        loads = best_of(lambda: json.loads(compact), args.repeat)
+        decode = best_of(lambda: columnar.decode(encoded), args.repeat)
+        columns = best_of(lambda: columnar.decode_columns(encoded), args.repeat)
+        print(f"\n  {'parse':<34}{'ms':>10}{'speedup':>10}")
+        print(f"  {'python json.loads':<34}{loads * 1000:>10.3f}")
+        print(f"  {'python columnar.decode (tree)':<34}{decode * 1000:>10.3f}{loads / decode:>9.1f}x")
+        print(f"  {'python columnar.decode_columns':<34}{columns * 1000:>10.3f}{loads / columns:>9.1f}x")
+        if decoder:
+            times = node_times(decoder, compact, encoded, args.repeat)
+            print(f"  {'node JSON.parse':<34}{times['json']:>10.3f}")
+            print(f"  {'node decodeColumnar (tree)':<34}{times['columnar']:>10.3f}"
+                  f"{times['json'] / times['columnar']:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Market-cap lookups against a synthetic quote service that throttles like Yahoo,
+with and without the upstream client's rate limiting, retries and circuit breaker.
+
+The service allows --rate-limit calls per second, answers anything beyond that
+with a 429, and blocks a caller that ignores the 429s for --block-time seconds.
+Each mode runs --rounds back-to-back refreshes on a fresh service.
+
+Usage: python3 bench_upstream.py [--tickers 500] [--rate-limit 40] [--rounds 3]
+"""
+
+import argparse
+import time
+from collections import Counter
+
+from market_caps import fetch_market_caps
+from providers import SyntheticProvider
+from upstream import UpstreamClient, RateLimiter, CircuitBreaker
+
+
+def run(label, tickers, service, fetch_one, args, client=None):
+    print(f"\n{label}")
+    print(f"{'round':>6}{'time':>9}{'ok':>7}{'failed':>8}{'calls/s':>9}  errors")
+    for i in range(args.rounds):
+        start = time.perf_counter()
+        caps, errors = fetch_market_caps(tickers, fetch_one=fetch_one, max_workers=args.workers,
+                                         timeout=args.timeout)
+        elapsed = time.perf_counter() - start
+        kinds = Counter(type(e).__name__ for e in errors.values())
+        summary = ", ".join(f"{k} {n}" for k, n in kinds.most_common()) or "-"
+        print(f"{i + 1:>6}{elapsed:>8.1f}s{len(caps):>7}{len(errors):>8}{len(caps) / elapsed:>9.1f}  {summary}")
+    if client:
+        print(f"  limiter rate {client.limiter.rate:.1f}/s, breaker {client.breaker.state()}, {client.stats}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--tickers', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.05, help="seconds per upstream call")
+    parser.add_argument('--rate-limit', type=float, default=40, help="calls per second the service allows")
+    parser.add_argument('--block-time', type=float, default=10.0)
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--timeout', type=float, default=30.0)
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+
+    tickers = [f"SYN{i:04d}" for i in range(args.tickers)]
+    print(f"{args.tickers} tickers, {args.workers} workers, service allows {args.rate_limit:.0f} calls/s")
+    print("=" * 60)
+
+    def service():
+        return SyntheticProvider(latency=args.latency, rate_limit=args.rate_limit,
+                                 block_time=args.block_time)
+
+    naive = service()
+    run("unguarded", tickers, naive, naive.market_cap, args)
+
+    guarded = service()
+    client = UpstreamClient(RateLimiter(), CircuitBreaker(reset_timeout=args.block_time))
+    run("upstream client", tickers, guarded, lambda t: client.call(guarded.market_cap, t), args, client)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+Compact columnar encoding of the sp500_data.json tree.
+
+The JSON tree repeats every key for every stock. The columnar form stores
+the same data as one small JSON header (top-level fields, sector names and
+sizes) followed by typed little-endian float64 columns for price, change and
+marketCap (NaN for null) and newline-separated ticker and name string tables.
+Stocks appear sector by sector in tree order, so the sector sizes are all
+that's needed to rebuild the tree. A browser can wrap the columns in
+Float64Arrays without parsing them.
+
+Layout:
+    0   b'TMC1'
+    4   uint32 header length (header is padded with spaces so columns start 8-byte aligned)
+    8   header JSON: top-level fields plus "columns": {count, sectors: [[name, size]],
+        tickerBytes, nameBytes}
+    ..  price[count], change[count], marketCap[count] as float64
+    ..  tickers, then names, UTF-8 joined with '\\n'
+"""
+
+import json
+import math
+import struct
+import sys
+from array import array
+
+MAGIC = b'TMC1'
+
+CONTENT_TYPE = 'application/x-treemap-columnar'
+
+# Float columns in the order they're stored
+COLUMNS = ('price', 'change', 'marketCap')
+
+
+def _column(values):
+    column = array('d', (math.nan if v is None else v for v in values))
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column.tobytes()
+
+
+def encode(data):
+    """Columnar bytes of a sp500_data.json tree"""
+    stocks = [stock for sector in data.get('children', []) for stock in sector.get('children', [])]
+    tickers = '\n'.join(s['ticker'] for s in stocks).encode()
+    names = '\n'.join(s['name'] for s in stocks).encode()
+
+    header = {k: v for k, v in data.items() if k != 'children'}
+    header['columns'] = {
+        "count": len(stocks),
+        "sectors": [[sector['name'], len(sector.get('children', []))] for sector in data.get('children', [])],
+        "tickerBytes": len(tickers),
+        "nameBytes": len(names)
+    }
+    header = json.dumps(header, separators=(',', ':')).encode()
+    header += b' ' * (-len(header) % 8)
+
+    parts = [MAGIC, struct.pack('<I', len(header)), header]
+    parts.extend(_column(s.get(field) for s in stocks) for field in COLUMNS)
+    parts.extend((tickers, names))
+    return b''.join(parts)
+
+
+def decode_columns(body):
+    """(header, {field: array of floats}, tickers, names) of columnar bytes"""
+    if body[:4] != MAGIC:
+        raise ValueError("not a columnar snapshot")
+    header_length, = struct.unpack_from('<I', body, 4)
+    header = json.loads(body[8:8 + header_length])
+    columns = header['columns']
+    count = columns['count']
+
+    offset = 8 + header_length
+    values = {}
+    for field in COLUMNS:
+        column = array('d')
+        column.frombytes(body[offset:offset + 8 * count])
+        if sys.byteorder == 'big':
+            column.byteswap()
+        values[field] = column
+        offset += 8 * count
+
+    tickers = body[offset:offset + columns['tickerBytes']].decode().split('\n') if count else []
+    offset += columns['tickerBytes']
+    names = body[offset:offset + columns['nameBytes']].decode().split('\n') if count else []
+    return header, values, tickers, names
+
+
+def decode(body):
+    """The sp500_data.json tree encoded in columnar bytes"""
+    header, values, tickers, names = decode_columns(body)
+    columns = header.pop('columns')
+    prices, changes, caps = (values[field] for field in COLUMNS)
+
+    data = dict(header, children=[])
+    start = 0
+    for name, size in columns['sectors']:
+        children = []
+        for i in range(start, start + size):
+            children.append({
+                "ticker": tickers[i],
+                "name": names[i],
+                "marketCap": None if caps[i] != caps[i] else caps[i],
+                "price": None if prices[i] != prices[i] else prices[i],
+                "change": None if changes[i] != changes[i] else changes[i]
+            })
+        start += size
+        data['children'].append({"name": name, "children": children})
+    return data
+
+
+def accepts_columnar(accept):
+    """Whether an Accept header asks for the columnar encoding"""
+    for part in (accept or '').split(','):
+        media_type, _, params = part.strip().partition(';')
+        if media_type.strip().lower() == CONTENT_TYPE:
+            params = params.replace(' ', '')
+            return params not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000')
+    return False
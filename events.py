@@ -0,0 +1,144 @@
+"""
+Server-Sent Events fan-out.
+
+Handlers write the SSE response headers and then hand their socket to the
+EventHub, which keeps every subscriber on one thread: each published event
+is encoded once, queued on every subscriber's buffer, and written out as
+sockets become writable. Clients that fall too far behind are dropped.
+"""
+
+import json
+import selectors
+import socket
+import threading
+import time
+
+# Seconds between keep-alive comments sent to idle subscribers
+HEARTBEAT_INTERVAL = 15
+
+# Subscribers with more than this many unsent bytes are disconnected
+MAX_PENDING_BYTES = 1 << 20
+
+
+def format_event(event, data):
+    """Encode one SSE message with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode()
+
+
+class EventHub:
+    """Pushes events to any number of SSE subscribers from a single thread"""
+
+    def __init__(self, heartbeat=HEARTBEAT_INTERVAL, max_pending=MAX_PENDING_BYTES):
+        self.heartbeat = heartbeat
+        self.max_pending = max_pending
+        self._selector = selectors.DefaultSelector()
+        self._pending = {}  # socket -> bytearray of unsent data
+        self._lock = threading.Lock()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ)
+        self._thread = None
+
+    def start(self):
+        """Start the delivery thread (idempotent)"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='events', daemon=True)
+                self._thread.start()
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    def subscribe(self, sock, initial=b''):
+        """Take over `sock`, whose response headers have already been sent"""
+        self.start()
+        sock.setblocking(False)
+        with self._lock:
+            self._pending[sock] = bytearray(initial)
+            self._selector.register(sock, selectors.EVENT_READ | selectors.EVENT_WRITE)
+        self._wake()
+
+    def publish(self, event, data):
+        """Queue an event for every subscriber"""
+        message = format_event(event, data)
+        self._broadcast(message)
+
+    def _broadcast(self, message):
+        with self._lock:
+            for sock, buf in self._pending.items():
+                buf += message
+        self._wake()
+
+    def _wake(self):
+        try:
+            self._wake_w.send(b'\0')
+        except (BlockingIOError, OSError):
+            pass
+
+    def _drop(self, sock):
+        # Called with the lock held
+        self._pending.pop(sock, None)
+        try:
+            self._selector.unregister(sock)
+        except (KeyError, ValueError):
+            pass
+        try:
+            sock.close()
+        except OSError:
+            pass
+
+    def _run(self):
+        last_beat = time.monotonic()
+        while True:
+            # Drop subscribers that stopped reading, and only ask to be told
+            # about writability for sockets with data queued
+            with self._lock:
+                for sock, buf in list(self._pending.items()):
+                    if len(buf) > self.max_pending:
+                        self._drop(sock)
+                        continue
+                    mask = selectors.EVENT_READ | (selectors.EVENT_WRITE if buf else 0)
+                    if self._selector.get_key(sock).events != mask:
+                        self._selector.modify(sock, mask)
+
+            ready = self._selector.select(timeout=self.heartbeat)
+
+            with self._lock:
+                for key, mask in ready:
+                    sock = key.fileobj
+                    if sock is self._wake_r:
+                        try:
+                            while self._wake_r.recv(4096):
+                                pass
+                        except (BlockingIOError, OSError):
+                            pass
+                        continue
+                    if sock not in self._pending:
+                        continue
+                    if mask & selectors.EVENT_READ:
+                        # Subscribers never send anything; readable means closed
+                        try:
+                            if not sock.recv(4096):
+                                self._drop(sock)
+                                continue
+                        except BlockingIOError:
+                            pass
+                        except OSError:
+                            self._drop(sock)
+                            continue
+                    if mask & selectors.EVENT_WRITE:
+                        buf = self._pending[sock]
+                        try:
+                            sent = sock.send(buf)
+                            del buf[:sent]
+                        except BlockingIOError:
+                            pass
+                        except OSError:
+                            self._drop(sock)
+
+            now = time.monotonic()
+            if now - last_beat >= self.heartbeat:
+                last_beat = now
+                self._broadcast(b': keep-alive\n\n')
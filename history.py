@@ -0,0 +1,315 @@
+"""
+Append-only history of every published snapshot.
+
+Each snapshot becomes one row in three float32 column files (price, change,
+marketCap) plus a float64 timestamp, all appended in place and read back
+through NumPy memory maps. A JSON ticker index maps each ticker to its
+column, so a range query is two binary searches on the timestamps and a
+strided read of one column. Rows older than the retention window are
+dropped, and rows older than a few days are thinned out, when the store
+compacts itself (at most once a day). NumPy is only imported once the
+store is first written or read, so opening one costs nothing at startup.
+
+Widening and compaction write a complete new generation of column files and
+switch to it by rewriting index.json, so a crash leaves either the old files
+or the new ones in use, never a mix. Opening a store truncates a row torn by
+a crash mid-append, so every column stays aligned with the timestamps.
+"""
+
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+HISTORY_DIR = "history"
+
+# Rows older than this many seconds are deleted
+RETENTION = 180 * 24 * 3600
+
+# Rows older than COMPACT_AFTER are thinned to one per COMPACT_RESOLUTION seconds
+COMPACT_AFTER = 3 * 24 * 3600
+COMPACT_RESOLUTION = 15 * 60
+
+# Seconds between automatic compactions
+COMPACT_EVERY = 24 * 3600
+
+FIELDS = ('price', 'change', 'marketCap')
+
+INDEX_FILE = "index.json"
+TIMESTAMPS_FILE = "timestamps.f8"
+
+
+class HistoryStore:
+    """Per-ticker price, change and marketCap for every snapshot, as memory-mapped columns"""
+
+    def __init__(self, directory=HISTORY_DIR, retention=RETENTION, compact_after=COMPACT_AFTER,
+                 compact_resolution=COMPACT_RESOLUTION):
+        self.directory = directory
+        self.retention = retention
+        self.compact_after = compact_after
+        self.compact_resolution = compact_resolution
+        self._lock = threading.Lock()
+        self._maps = {}  # file name -> (size, memmap)
+
+        os.makedirs(directory, exist_ok=True)
+        index_path = os.path.join(directory, INDEX_FILE)
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                self.index = json.load(f)
+        else:
+            self.index = {"width": 0, "generation": 0, "tickers": [], "sectors": {}, "compacted_at": 0}
+        self._columns = {t: i for i, t in enumerate(self.index["tickers"])}
+        self._repair()
+
+    # -- files -------------------------------------------------------------
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _generation_file(self, name, generation=None):
+        """`name` in the given (default: current) generation; generation 0 keeps the plain name"""
+        generation = self.index.get("generation", 0) if generation is None else generation
+        if not generation:
+            return name
+        stem, ext = os.path.splitext(name)
+        return f"{stem}.{generation}{ext}"
+
+    def _field_file(self, field, generation=None):
+        return self._generation_file(f"{field}.f4", generation)
+
+    def _timestamps_file(self, generation=None):
+        return self._generation_file(TIMESTAMPS_FILE, generation)
+
+    def _files(self, generation=None):
+        """{file name: bytes per row} of one generation"""
+        files = {self._timestamps_file(generation): 8}
+        for field in FIELDS:
+            files[self._field_file(field, generation)] = 4 * self.index["width"]
+        return files
+
+    def _repair(self):
+        """Remove files of other generations and cut every column back to the last complete row"""
+        files = self._files()
+        for name in os.listdir(self.directory):
+            if name.endswith(('.f4', '.f8', '.tmp')) and name not in files:
+                os.remove(self._path(name))
+
+        sizes = {name: os.path.getsize(self._path(name)) if os.path.exists(self._path(name)) else 0
+                 for name in files}
+        rows = min(sizes[name] // row_bytes for name, row_bytes in files.items() if row_bytes)
+        for name, row_bytes in files.items():
+            if sizes[name] > rows * row_bytes:
+                os.truncate(self._path(name), rows * row_bytes)
+
+    def _save_index(self):
+        tmp = self._path(INDEX_FILE + ".tmp")
+        with open(tmp, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(tmp, self._path(INDEX_FILE))
+
+    def _map(self, name, dtype):
+        """Read-only memmap of a column file, reopened when the file grows"""
+        import numpy as np
+
+        path = self._path(name)
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        cached = self._maps.get(name)
+        if cached and cached[0] == size:
+            return cached[1]
+        arr = np.memmap(path, dtype=dtype, mode='r') if size else np.zeros(0, dtype=dtype)
+        self._maps[name] = (size, arr)
+        return arr
+
+    def _rows(self):
+        """(timestamps, {field: 2-D rows x width array}) for every complete row"""
+        import numpy as np
+
+        width = self.index["width"]
+        timestamps = self._map(self._timestamps_file(), np.float64)
+        n = len(timestamps)
+        columns = {}
+        for field in FIELDS:
+            flat = self._map(self._field_file(field), np.float32)
+            n = min(n, len(flat) // width if width else 0)
+            columns[field] = flat
+        columns = {f: a[:n * width].reshape(n, width) for f, a in columns.items()}
+        return timestamps[:n], columns
+
+    def _rewrite(self, timestamps, columns, width):
+        """
+        Write all column files as a new generation, then switch the index to
+        it (used by widening and compaction). Until index.json is replaced the
+        old generation stays in use, so a crash never mixes the two.
+        """
+        import numpy as np
+
+        old = self._files()
+        generation = self.index.get("generation", 0) + 1
+        arrays = {self._timestamps_file(generation): np.ascontiguousarray(timestamps, dtype=np.float64)}
+        for field in FIELDS:
+            arrays[self._field_file(field, generation)] = np.ascontiguousarray(columns[field], dtype=np.float32)
+        for name, arr in arrays.items():
+            with open(self._path(name), 'wb') as f:
+                arr.tofile(f)
+                f.flush()
+                os.fsync(f.fileno())
+
+        self.index["generation"] = generation
+        self.index["width"] = width
+        self._save_index()
+        self._maps.clear()
+        for name in old:
+            if os.path.exists(self._path(name)):
+                os.remove(self._path(name))
+
+    # -- writing -----------------------------------------------------------
+
+    def _widen(self, new_tickers):
+        """Give new tickers columns, rewriting the files if the width has to grow"""
+        import numpy as np
+
+        tickers = self.index["tickers"]
+        needed = len(tickers) + len(new_tickers)
+        width = self.index["width"]
+        if needed > width:
+            new_width = max(64, width * 2)
+            while new_width < needed:
+                new_width *= 2
+            timestamps, columns = self._rows()
+            grown = {}
+            for field in FIELDS:
+                arr = np.full((len(timestamps), new_width), np.nan, dtype=np.float32)
+                arr[:, :width] = columns[field]
+                grown[field] = arr
+            self._rewrite(np.array(timestamps), grown, new_width)
+        for ticker in new_tickers:
+            self._columns[ticker] = len(tickers)
+            tickers.append(ticker)
+
+    def append(self, data, ts=None):
+        """Record one snapshot (the sp500_data.json tree) as a new row"""
+        import numpy as np
+
+        ts = time.time() if ts is None else ts
+        with self._lock:
+            stocks = [(sector["name"], stock) for sector in data.get("children", [])
+                      for stock in sector.get("children", [])]
+            new_tickers = [s["ticker"] for _, s in stocks if s["ticker"] not in self._columns]
+            if new_tickers:
+                self._widen(new_tickers)
+            for sector_name, stock in stocks:
+                self.index["sectors"][stock["ticker"]] = sector_name
+
+            width = self.index["width"]
+            rows = {field: np.full(width, np.nan, dtype=np.float32) for field in FIELDS}
+            for _, stock in stocks:
+                col = self._columns[stock["ticker"]]
+                for field in FIELDS:
+                    value = stock.get(field)
+                    if value is not None:
+                        rows[field][col] = value
+
+            # Column rows first, timestamp last: a row only counts once its
+            # timestamp is on disk, and _repair cuts off a torn one on open
+            for field in FIELDS:
+                with open(self._path(self._field_file(field)), 'ab') as f:
+                    f.write(rows[field].tobytes())
+            with open(self._path(self._timestamps_file()), 'ab') as f:
+                f.write(np.float64(ts).tobytes())
+            self._save_index()
+
+            if ts - self.index.get("compacted_at", 0) >= COMPACT_EVERY:
+                self._compact(ts)
+
+    def compact(self, now=None):
+        """Apply retention and thin out old rows now"""
+        with self._lock:
+            self._compact(time.time() if now is None else now)
+
+    def _compact(self, now):
+        import numpy as np
+
+        timestamps, columns = self._rows()
+        keep = timestamps >= now - self.retention
+        old = timestamps < now - self.compact_after
+        if old.any():
+            # Keep the last row in each COMPACT_RESOLUTION bucket
+            buckets = (timestamps // self.compact_resolution).astype(np.int64)
+            last_in_bucket = np.ones(len(timestamps), dtype=bool)
+            last_in_bucket[:-1] = buckets[:-1] != buckets[1:]
+            keep &= ~old | last_in_bucket
+        if not keep.all():
+            self._rewrite(timestamps[keep], {f: columns[f][keep] for f in FIELDS}, self.index["width"])
+        self.index["compacted_at"] = now
+        self._save_index()
+
+    # -- reading -----------------------------------------------------------
+
+    def _range(self, timestamps, start, end):
+        import numpy as np
+
+        lo = 0 if start is None else int(np.searchsorted(timestamps, start, side='left'))
+        hi = len(timestamps) if end is None else int(np.searchsorted(timestamps, end, side='right'))
+        return lo, hi
+
+    def ticker_history(self, ticker, start=None, end=None):
+        """{'timestamps', 'price', 'change', 'marketCap'} for `ticker`, or None if unknown"""
+        with self._lock:
+            col = self._columns.get(ticker)
+            if col is None:
+                return None
+            timestamps, columns = self._rows()
+        lo, hi = self._range(timestamps, start, end)
+        result = {"ticker": ticker, "sector": self.index["sectors"].get(ticker),
+                  "timestamps": timestamps[lo:hi].tolist()}
+        for field in FIELDS:
+            result[field] = _to_list(columns[field][lo:hi, col])
+        return result
+
+    def sectors(self):
+        with self._lock:
+            return sorted(set(self.index["sectors"].values()))
+
+    def sector_history(self, sector, start=None, end=None):
+        """Cap-weighted change and total marketCap of a sector per snapshot, or None if unknown"""
+        import numpy as np
+
+        with self._lock:
+            cols = [self._columns[t] for t, s in self.index["sectors"].items() if s == sector]
+            if not cols:
+                return None
+            timestamps, columns = self._rows()
+        lo, hi = self._range(timestamps, start, end)
+        caps = np.asarray(columns['marketCap'][lo:hi][:, cols], dtype=np.float64)
+        changes = np.asarray(columns['change'][lo:hi][:, cols], dtype=np.float64)
+        valid = ~np.isnan(caps) & ~np.isnan(changes)
+        weights = np.where(valid, caps, 0.0)
+        total = weights.sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            weighted = (np.where(valid, changes, 0.0) * weights).sum(axis=1) / total
+        return {
+            "sector": sector,
+            "tickers": len(cols),
+            "timestamps": timestamps[lo:hi].tolist(),
+            "change": _to_list(weighted),
+            "marketCap": _to_list(np.nansum(caps, axis=1))
+        }
+
+
+def _to_list(arr):
+    """Floats rounded for JSON, with NaN as None"""
+    import numpy as np
+
+    values = np.round(np.asarray(arr, dtype=np.float64), 4)
+    return [None if v != v else v for v in values.tolist()]
+
+
+def parse_time(value):
+    """Epoch seconds from a query value: a number or an ISO 8601 date/time"""
+    if value is None or value == '':
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
@@ -0,0 +1,193 @@
+"""
+Multi-horizon performance views (1W, 1M, 3M, YTD) next to the day's change.
+
+The first full refresh of a trading day downloads a year of daily bars
+instead of five days. HorizonCloses keeps those closes (on disk in
+CACHE_FILE, so a restart doesn't refetch) and finds every ticker's reference
+close for every horizon in one vectorized step. The saved closes are only
+read (and NumPy imported) when a horizon view or a refresh first needs them,
+so they cost nothing at startup. Snapshots turn the reference
+closes into returns against their own prices, so partial and live snapshots
+get horizon views too and switching horizons costs no upstream fetch.
+"""
+
+import calendar
+import os
+import threading
+from datetime import date, timedelta
+
+from live import market_date
+
+# Horizons served besides the regular day-over-day change, shortest first
+HORIZONS = ('1W', '1M', '3M', 'YTD')
+
+# The regular view: change since the previous close
+DAY = '1D'
+
+# Download period long enough for every horizon
+LONG_PERIOD = '1y'
+
+# Daily closes of the last long download
+CACHE_FILE = "horizon_closes.npz"
+
+
+def anchor_date(horizon, today):
+    """The date whose close `horizon` is measured from"""
+    if horizon == 'YTD':
+        return date(today.year - 1, 12, 31)
+    if horizon == '1W':
+        return today - timedelta(days=7)
+    months = {'1M': 1, '3M': 3}[horizon]
+    year, month = divmod(today.year * 12 + today.month - 1 - months, 12)
+    month += 1
+    # Clamp to the month's last day (e.g. May 31 -> Feb 28)
+    return date(year, month, min(today.day, calendar.monthrange(year, month)[1]))
+
+
+def reference_closes(values, dates, today, horizons=HORIZONS):
+    """
+    (horizons x tickers) array of each column's last close on or before
+    each horizon's anchor date, NaN where a ticker has none. `values` is a
+    (dates x tickers) close matrix and `dates` its sorted datetime64[D] rows.
+    """
+    import numpy as np
+
+    refs = np.full((len(horizons), values.shape[1]), np.nan)
+    if not len(dates):
+        return refs
+
+    # Per column, the row of the latest non-NaN value at or before each row
+    rows = np.arange(values.shape[0])[:, None]
+    filled = np.maximum.accumulate(np.where(np.isnan(values), -1, rows), axis=0)
+
+    anchors = np.array([np.datetime64(anchor_date(h, today)) for h in horizons])
+    anchor_rows = np.searchsorted(dates, anchors, side='right') - 1
+    pos = filled[np.maximum(anchor_rows, 0)]
+    pos[anchor_rows < 0] = -1
+    found = pos >= 0
+    cols = np.broadcast_to(np.arange(values.shape[1]), pos.shape)
+    refs[found] = values[pos[found], cols[found]]
+    return refs
+
+
+def horizon_views(data, references):
+    """
+    {horizon: output tree with `change` measured over that horizon} for
+    every horizon, from a {ticker: (reference close per HORIZONS)} dict.
+    Returns are computed for all stocks and horizons at once.
+    """
+    import numpy as np
+
+    stocks = [stock for sector in data.get('children', []) for stock in sector.get('children', [])]
+    missing = (np.nan,) * len(HORIZONS)
+    prices = np.array([np.nan if s.get('price') is None else s['price'] for s in stocks], dtype=np.float64)
+    refs = np.array([references.get(s['ticker'], missing) for s in stocks],
+                    dtype=np.float64).reshape(len(stocks), len(HORIZONS))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = np.round((prices[:, None] / refs - 1) * 100, 2)
+    returns[~np.isfinite(returns)] = np.nan
+
+    views = {}
+    for h, horizon in enumerate(HORIZONS):
+        column = iter(returns[:, h].tolist())
+        view = {k: v for k, v in data.items() if k != 'children'}
+        view['children'] = [
+            {"name": sector['name'],
+             "children": [dict(stock, change=None if change != change else change)
+                          for stock, change in zip(sector.get('children', []), column)]}
+            for sector in data.get('children', [])
+        ]
+        views[horizon] = view
+    return views
+
+
+class HorizonCloses:
+    """
+    Daily closes of today's long download and the reference closes derived
+    from them. The closes are saved by yfinance symbol; the reference closes
+    are keyed by the universe's tickers, like the output tree.
+    """
+
+    def __init__(self, universe, path=CACHE_FILE):
+        self.universe = universe
+        self.path = path
+        self.fetched_on = None
+        self._references = {}  # ticker -> (reference close per HORIZONS)
+        self._frames = []
+        self._loaded = False
+        self._load_lock = threading.Lock()
+
+    @property
+    def references(self):
+        """{ticker: (reference close per HORIZONS)}, read from the saved closes on first use"""
+        self._load_once()
+        return self._references
+
+    def current(self, now=None):
+        """Whether today's long download has been done (otherwise the next full refresh does it)"""
+        self._load_once()
+        return self.fetched_on == market_date(now)
+
+    def _load_once(self):
+        if not self._loaded:
+            with self._load_lock:
+                if not self._loaded:
+                    self.load()
+                    self._loaded = True
+
+    def begin(self):
+        """Start collecting the closes of a long download"""
+        self._frames = []
+
+    def add(self, chunk, closes):
+        """Keep one downloaded batch's (dates x tickers) close matrix"""
+        if closes is not None and not closes.empty:
+            self._frames.append(closes)
+
+    def finish(self):
+        """Combine the collected batches, derive the reference closes and save them"""
+        import numpy as np
+        import pandas as pd
+
+        if not self._frames:
+            return
+        closes = pd.concat(self._frames, axis=1).sort_index()
+        self._frames = []
+        closes = closes.loc[:, ~closes.columns.duplicated()]
+        dates = closes.index.tz_localize(None).normalize().to_numpy().astype('datetime64[D]')
+        values = closes.to_numpy(dtype=np.float64, na_value=np.nan)
+        tickers = np.array([str(t) for t in closes.columns])
+        self._use(tickers, dates, values, market_date())
+
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez_compressed(f, tickers=tickers, dates=dates, values=values,
+                                fetched_on=np.datetime64(self.fetched_on))
+        os.replace(tmp, self.path)
+
+    def load(self):
+        """Reuse the saved closes if they're from today's long download"""
+        if not os.path.exists(self.path):
+            return False
+        import numpy as np
+
+        try:
+            with np.load(self.path) as saved:
+                fetched_on = saved['fetched_on'].item()
+                if fetched_on != market_date():
+                    return False
+                self._use(saved['tickers'], saved['dates'], saved['values'], fetched_on)
+        except (OSError, ValueError, KeyError):
+            return False
+        return True
+
+    def _use(self, tickers, dates, values, fetched_on):
+        refs = reference_closes(values, dates, fetched_on)
+        references = {}
+        for symbol, column in zip(tickers.tolist(), refs.T.tolist()):
+            entry = self.universe.from_symbol(symbol)
+            if entry is not None:  # indices aren't in the tree
+                references[entry[0]] = tuple(column)
+        self._references = references
+        self.fetched_on = fetched_on
+        self._loaded = True
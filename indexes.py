@@ -0,0 +1,89 @@
+"""
+Query indexes built once per snapshot for /api/movers, /api/search and
+/api/sectors, so clients can ask for top movers, search results or sector
+totals without downloading and re-sorting the whole dataset.
+"""
+
+from bisect import bisect_left
+
+# Most results a single movers or search query returns
+MAX_LIMIT = 100
+
+
+class SnapshotIndex:
+    """Stocks sorted by change, a ticker/name prefix index and per-sector aggregates"""
+
+    def __init__(self, data):
+        self.stocks = [
+            dict(stock, sector=sector['name'])
+            for sector in data.get('children', [])
+            for stock in sector.get('children', [])
+        ]
+
+        # Largest change first; stocks without a change are left out
+        self.by_change = sorted((s for s in self.stocks if s.get('change') is not None),
+                                key=lambda s: s['change'], reverse=True)
+
+        # (lowercase key, position) for each ticker, full name and word of the name
+        keys = []
+        for pos, stock in enumerate(self.stocks):
+            name = stock['name'].lower()
+            words = {stock['ticker'].lower(), name}
+            words.update(w for w in name.replace('.', ' ').replace(',', ' ').split() if w)
+            keys.extend((w, pos) for w in words)
+        keys.sort()
+        self._keys = [k for k, _ in keys]
+        self._positions = [p for _, p in keys]
+
+        self.sectors = [self._sector_summary(sector) for sector in data.get('children', [])]
+
+    def movers(self, type='gainers', limit=10):
+        """The `limit` biggest gainers or losers"""
+        if limit <= 0:
+            return []
+        if type == 'losers':
+            return self.by_change[-limit:][::-1]
+        return self.by_change[:limit]
+
+    def search(self, query, limit=8):
+        """
+        Stocks whose ticker, name or a word of the name starts with `query`:
+        exact ticker first, then ticker prefixes, then name matches, each
+        group largest market cap first.
+        """
+        query = query.lower().strip()
+        if not query:
+            return []
+        positions = set()
+        i = bisect_left(self._keys, query)
+        while i < len(self._keys) and self._keys[i].startswith(query):
+            positions.add(self._positions[i])
+            i += 1
+
+        def rank(pos):
+            stock = self.stocks[pos]
+            ticker = stock['ticker'].lower()
+            group = 0 if ticker == query else 1 if ticker.startswith(query) else 2
+            return group, -(stock.get('marketCap') or 0)
+
+        return [self.stocks[pos] for pos in sorted(positions, key=rank)[:limit]]
+
+    def _sector_summary(self, sector):
+        """Cap-weighted change and breadth (advancers vs decliners) of one sector"""
+        stocks = sector.get('children', [])
+        priced = [s for s in stocks if s.get('change') is not None]
+        total_cap = sum(s.get('marketCap') or 0 for s in stocks)
+        weight = sum(s.get('marketCap') or 0 for s in priced)
+        advancers = sum(1 for s in priced if s['change'] > 0)
+        decliners = sum(1 for s in priced if s['change'] < 0)
+        return {
+            "name": sector['name'],
+            "stocks": len(stocks),
+            "marketCap": round(total_cap, 2),
+            "change": round(sum(s['change'] * (s.get('marketCap') or 0) for s in priced) / weight, 2)
+                      if weight else None,
+            "advancers": advancers,
+            "decliners": decliners,
+            "unchanged": len(priced) - advancers - decliners,
+            "breadth": round((advancers - decliners) / len(priced), 4) if priced else None
+        }
@@ -0,0 +1,233 @@
+"""
+Squarified treemap layout computed on the server.
+
+treemap_layout() reproduces what initTreemap() in index.html gets from
+d3.hierarchy + d3.treemap (squarify with the golden ratio, paddingOuter 3,
+paddingTop 19, paddingInner 1, rounded to whole pixels) and adds the label
+sizes and visibility the page would otherwise measure per node
+(bench_layout.py checks it against d3's rectangles for a reference tree).
+LayoutCache keeps recent layouts per (snapshot version, viewport bucket) so
+a wall of identical displays costs one computation per snapshot.
+"""
+
+import gzip
+import json
+import math
+import threading
+from collections import OrderedDict
+
+# d3.treemapSquarify's default target aspect ratio
+RATIO = (1 + math.sqrt(5)) / 2
+
+PADDING_OUTER = 3
+PADDING_TOP = 19
+PADDING_INNER = 1
+
+# Viewports are rounded down to multiples of this many pixels before layout,
+# so nearby window sizes share a cached layout
+VIEWPORT_BUCKET = 8
+
+# Smallest and largest viewport dimension accepted
+MIN_SIZE = 64
+MAX_SIZE = 8192
+
+# Layouts kept in the LRU cache
+CACHE_SIZE = 64
+
+# Approximate width of one uppercase sector-label character (11px bold, 1px letter spacing)
+SECTOR_CHAR_WIDTH = 8.5
+
+
+class Node:
+    __slots__ = ('data', 'value', 'children', 'x0', 'y0', 'x1', 'y1')
+
+    def __init__(self, data, children=None):
+        self.data = data
+        self.children = children
+        if children:
+            children.sort(key=lambda c: c.value, reverse=True)
+            self.value = sum(c.value for c in children)
+        else:
+            self.value = data.get('marketCap') or 0
+        self.x0 = self.y0 = self.x1 = self.y1 = 0.0
+
+
+def _dice(nodes, value, x0, y0, x1, y1):
+    """Lay `nodes` out left to right"""
+    k = (x1 - x0) / value if value else 0
+    for node in nodes:
+        node.y0, node.y1 = y0, y1
+        node.x0 = x0
+        x0 += node.value * k
+        node.x1 = x0
+
+
+def _slice(nodes, value, x0, y0, x1, y1):
+    """Lay `nodes` out top to bottom"""
+    k = (y1 - y0) / value if value else 0
+    for node in nodes:
+        node.x0, node.x1 = x0, x1
+        node.y0 = y0
+        y0 += node.value * k
+        node.y1 = y0
+
+
+def squarify(parent, x0, y0, x1, y1, ratio=RATIO):
+    """d3.treemapSquarify: rows of children with aspect ratios as close to `ratio` as possible"""
+    nodes = parent.children
+    value = parent.value
+    n = len(nodes)
+    i0 = i1 = 0
+    while i0 < n:
+        dx, dy = x1 - x0, y1 - y0
+
+        # Find the next non-empty node
+        while True:
+            sum_value = nodes[i1].value
+            i1 += 1
+            if sum_value or i1 >= n:
+                break
+        min_value = max_value = sum_value
+        alpha = max(dy / dx, dx / dy) / (value * ratio) if dx and dy and value else 0
+        beta = sum_value * sum_value * alpha
+        min_ratio = max(max_value / beta, beta / min_value) if beta and min_value else math.inf
+
+        # Keep adding nodes while the aspect ratio maintains or improves
+        while i1 < n:
+            node_value = nodes[i1].value
+            sum_value += node_value
+            min_value = min(min_value, node_value)
+            max_value = max(max_value, node_value)
+            beta = sum_value * sum_value * alpha
+            new_ratio = max(max_value / beta, beta / min_value) if beta and min_value else math.inf
+            if new_ratio > min_ratio:
+                sum_value -= node_value
+                break
+            min_ratio = new_ratio
+            i1 += 1
+
+        row = nodes[i0:i1]
+        if dx < dy:
+            y = y0 + dy * sum_value / value if value else y1
+            _dice(row, sum_value, x0, y0, x1, y)
+            y0 = y
+        else:
+            x = x0 + dx * sum_value / value if value else x1
+            _slice(row, sum_value, x0, y0, x, y1)
+            x0 = x
+        value -= sum_value
+        i0 = i1
+
+
+def _position(node, pad):
+    """d3.treemap's positionNode: apply padding, then tile the children"""
+    x0, y0, x1, y1 = node.x0 + pad, node.y0 + pad, node.x1 - pad, node.y1 - pad
+    if x1 < x0:
+        x0 = x1 = (x0 + x1) / 2
+    if y1 < y0:
+        y0 = y1 = (y0 + y1) / 2
+    node.x0, node.y0, node.x1, node.y1 = x0, y0, x1, y1
+    if node.children:
+        inner = PADDING_INNER / 2
+        x0 += PADDING_OUTER - inner
+        y0 += PADDING_TOP - inner
+        x1 -= PADDING_OUTER - inner
+        y1 -= PADDING_OUTER - inner
+        if x1 < x0:
+            x0 = x1 = (x0 + x1) / 2
+        if y1 < y0:
+            y0 = y1 = (y0 + y1) / 2
+        squarify(node, x0, y0, x1, y1)
+        for child in node.children:
+            _position(child, inner)
+
+
+def _round(v):
+    """Math.round, which rounds halves up"""
+    return int(math.floor(v + 0.5))
+
+
+def _sector_label(name, width):
+    """The sector name, cut down with '...' to fit like initTreemap() does"""
+    available = width - 10
+    if len(name) * SECTOR_CHAR_WIDTH <= available:
+        return name
+    content = name
+    while content and (len(content) + 3) * SECTOR_CHAR_WIDTH > available:
+        content = content[:-1]
+    return content + '...'
+
+
+def treemap_layout(data, width, height):
+    """
+    Rectangles and label sizes for a sp500_data.json tree at `width` x `height`:
+    {"width", "height", "sectors": [{name, label, x, y, w, h}], "nodes":
+    [{ticker, sector, x, y, w, h, tickerSize, changeSize, showTicker, showChange}]}
+    """
+    sectors = [Node(sector, [Node(stock) for stock in sector.get('children', [])])
+               for sector in data.get('children', [])]
+    root = Node({}, sectors)
+    root.x1, root.y1 = width, height
+    _position(root, 0)
+
+    out_sectors = []
+    out_nodes = []
+    for sector in root.children:
+        x0, y0, x1, y1 = (_round(v) for v in (sector.x0, sector.y0, sector.x1, sector.y1))
+        out_sectors.append({"name": sector.data['name'], "label": _sector_label(sector.data['name'], x1 - x0),
+                            "x": x0, "y": y0, "w": x1 - x0, "h": y1 - y0})
+        for node in sector.children:
+            x0, y0, x1, y1 = (_round(v) for v in (node.x0, node.y0, node.x1, node.y1))
+            w, h = max(0, x1 - x0), max(0, y1 - y0)
+            out_nodes.append({
+                "ticker": node.data['ticker'],
+                "sector": sector.data['name'],
+                "x": x0, "y": y0, "w": w, "h": h,
+                "tickerSize": round(min(14, max(8, w / 5)), 1),
+                "changeSize": round(min(11, max(7, w / 6)), 1),
+                "showTicker": w >= 35 and h >= 25,
+                "showChange": w >= 45 and h >= 35 and node.data.get('change') is not None
+            })
+    return {"width": width, "height": height, "sectors": out_sectors, "nodes": out_nodes}
+
+
+def viewport_bucket(width, height):
+    """Clamp a viewport and round it down to VIEWPORT_BUCKET pixels"""
+    def bucket(v):
+        v = max(MIN_SIZE, min(MAX_SIZE, int(v)))
+        return v - v % VIEWPORT_BUCKET
+    return bucket(width), bucket(height)
+
+
+class LayoutCache:
+    """LRU of encoded layouts keyed by (snapshot version, viewport bucket)"""
+
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, snapshot, width, height):
+        """(body, gzip_body) of the layout for `snapshot` at a viewport, computing it if needed"""
+        width, height = viewport_bucket(width, height)
+        key = (snapshot.version, width, height)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        layout = treemap_layout(snapshot.data, width, height)
+        layout["version"] = snapshot.version
+        body = json.dumps(layout, separators=(',', ':')).encode()
+        entry = (body, gzip.compress(body, compresslevel=6, mtime=0))
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return entry
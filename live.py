@@ -0,0 +1,98 @@
+"""
+Incremental intraday updates between full refreshes.
+
+A full refresh downloads days of daily bars and looks up every market cap.
+After one has run, LiveQuotes remembers each ticker's previous close, price
+and market cap, and a live cycle only downloads the newest intraday bar per
+ticker. Change is recomputed against the remembered previous close, and the
+market cap is scaled by the price move since shares outstanding don't change
+intraday.
+"""
+
+import copy
+from datetime import datetime
+
+from pipeline import close_matrix, last_two_valid, to_yf_ticker, CHUNK_SIZE
+from scheduler import MARKET_TZ
+
+# Seconds between live cycles while the market is open
+LIVE_INTERVAL = 60
+
+# Bar size asked for in live cycles
+INTERVAL = '1m'
+
+
+def market_date(now=None):
+    """The trading date in New York"""
+    return (now or datetime.now(MARKET_TZ)).astimezone(MARKET_TZ).date()
+
+
+class LiveQuotes:
+    """Previous closes, prices and market caps from the last full refresh"""
+
+    def __init__(self):
+        self.base = {}  # yfinance symbol -> (previous close, price, market cap)
+        self.seeded_on = None
+
+    def seed(self, results, known_caps=None):
+        """Remember a full refresh's {ticker: {'price', 'change', 'marketCap'}} results"""
+        known_caps = known_caps or {}
+        base = {}
+        for yf_ticker, r in results.items():
+            ratio = 1 + r['change'] / 100
+            if ratio <= 0:
+                continue
+            base[yf_ticker] = (r['price'] / ratio, r['price'], r['marketCap'] or known_caps.get(yf_ticker))
+        self.base = base
+        self.seeded_on = market_date()
+
+    def current(self, now=None):
+        """Whether the previous closes are from today's session (otherwise a full refresh is due)"""
+        return bool(self.base) and self.seeded_on == market_date(now)
+
+    def poll(self, provider, tickers, chunk_size=CHUNK_SIZE, interval=INTERVAL):
+        """{ticker: latest price} from the newest intraday bar of every seeded ticker"""
+        import numpy as np
+
+        tickers = [t for t in tickers if t in self.base]
+        prices = {}
+        for i in range(0, len(tickers), chunk_size):
+            chunk = tickers[i:i + chunk_size]
+            closes = close_matrix(provider.latest(chunk, interval=interval), chunk)
+            if closes is None or closes.empty:
+                continue
+            values = closes.to_numpy(dtype=np.float64, na_value=np.nan)
+            last, _ = last_two_valid(values)
+            for col in np.flatnonzero(last >= 0):
+                prices[closes.columns[col]] = float(values[last[col], col])
+        return prices
+
+    def apply(self, output, prices):
+        """
+        A copy of the output tree with `prices` applied. Returns (output,
+        updated) where updated counts entries whose values changed.
+        """
+        output = copy.deepcopy(output)
+        updated = 0
+        for idx, entry in output.get("indices", {}).items():
+            if idx in prices:
+                change = round((prices[idx] / self.base[idx][0] - 1) * 100, 2)
+                if entry.get("changePercent") != change:
+                    entry["changePercent"] = change
+                    updated += 1
+        for sector in output.get("children", []):
+            for stock in sector.get("children", []):
+                yf_ticker = to_yf_ticker(stock["ticker"])
+                if yf_ticker not in prices:
+                    continue
+                prev_close, base_price, base_cap = self.base[yf_ticker]
+                price = prices[yf_ticker]
+                fields = {"price": round(price, 2), "change": round((price / prev_close - 1) * 100, 2)}
+                if base_cap:
+                    fields["marketCap"] = round(base_cap * price / base_price, 2)
+                if any(stock.get(k) != v for k, v in fields.items()):
+                    stock.update(fields)
+                    updated += 1
+        if updated:
+            output["lastUpdated"] = datetime.now().isoformat()
+        return output, updated
@@ -0,0 +1,201 @@
+"""
+Concurrent market-cap fetching.
+
+Market caps come from one yfinance `fast_info` lookup per ticker, which is a
+separate network round-trip each time. Running them one after another is the
+slowest part of a refresh, so they go through a bounded thread pool here.
+"""
+
+import sqlite3
+import time
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Default number of lookups in flight at once
+MAX_WORKERS = 16
+
+# Seconds a single lookup may take before it is given up on
+REQUEST_TIMEOUT = 10.0
+
+# Per-lookup timeout used by refreshes (server.py, fetch_data.py); it also
+# covers rate-limit waits and retries in the upstream client
+REFRESH_TIMEOUT = 30.0
+
+
+def yf_market_cap(yf_ticker):
+    """Look up one market cap in billions via yfinance (None if unavailable)"""
+    import yfinance as yf
+
+    info = yf.Ticker(yf_ticker).fast_info
+    market_cap = info.get('marketCap', 0)
+    if market_cap:
+        return market_cap / 1e9  # Convert to billions
+    return None
+
+
+def fetch_market_caps(tickers, fetch_one=yf_market_cap, max_workers=MAX_WORKERS,
+                      timeout=REQUEST_TIMEOUT, progress=None):
+    """
+    Fetch market caps for `tickers` concurrently.
+
+    `fetch_one(ticker)` returns a market cap in billions, or None. At most
+    `max_workers` lookups run at once, and a lookup still running after
+    `timeout` seconds is abandoned and counted as a failure. `progress(done,
+    total)` is called from the calling thread as lookups finish.
+
+    Returns (caps, errors): caps maps ticker -> market cap for every lookup
+    that succeeded, errors maps ticker -> the exception (or TimeoutError) for
+    every lookup that failed.
+    """
+    tickers = list(tickers)
+    total = len(tickers)
+    caps = {}
+    errors = {}
+    if not tickers:
+        return caps, errors
+
+    started = {}
+
+    def run(ticker):
+        started[ticker] = time.monotonic()
+        return fetch_one(ticker)
+
+    pool = ThreadPoolExecutor(max_workers=max(1, min(max_workers, total)))
+    try:
+        pending = {pool.submit(run, t): t for t in tickers}
+        done_count = 0
+        while pending:
+            finished, _ = wait(pending, timeout=min(0.25, timeout), return_when=FIRST_COMPLETED)
+            for future in finished:
+                ticker = pending.pop(future)
+                try:
+                    value = future.result()
+                    if value:
+                        caps[ticker] = value
+                except Exception as e:
+                    errors[ticker] = e
+                done_count += 1
+
+            # Give up on lookups that have been running for too long. The
+            # worker thread can't be interrupted, but its result is ignored.
+            now = time.monotonic()
+            for future, ticker in list(pending.items()):
+                start = started.get(ticker)
+                if start is not None and now - start > timeout:
+                    future.cancel()
+                    del pending[future]
+                    errors[ticker] = TimeoutError(f"market cap lookup timed out after {timeout}s")
+                    done_count += 1
+
+            if progress and (finished or done_count == total):
+                progress(done_count, total)
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    return caps, errors
+
+
+# On-disk cache of the last good market cap per ticker
+CACHE_PATH = "market_caps.db"
+
+# Entries younger than this (seconds) are served without a lookup
+CACHE_TTL = 12 * 3600
+
+# Entries older than this (seconds) are evicted entirely
+CACHE_MAX_AGE = 30 * 24 * 3600
+
+
+class MarketCapCache:
+    """SQLite-backed market caps (billions) keyed by ticker, with a fetch timestamp per entry"""
+
+    def __init__(self, path=CACHE_PATH, ttl=CACHE_TTL, max_age=CACHE_MAX_AGE):
+        self.path = path
+        self.ttl = ttl
+        self.max_age = max_age
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS market_caps ("
+                " ticker TEXT PRIMARY KEY,"
+                " market_cap REAL NOT NULL,"
+                " fetched_at REAL NOT NULL)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5.0)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def lookup(self, tickers, now=None):
+        """Split cached entries for `tickers` into (fresh, stale) dicts of ticker -> market cap"""
+        now = time.time() if now is None else now
+        wanted = set(tickers)
+        fresh = {}
+        stale = {}
+        with self._connect() as conn:
+            rows = conn.execute("SELECT ticker, market_cap, fetched_at FROM market_caps").fetchall()
+        for ticker, market_cap, fetched_at in rows:
+            if ticker not in wanted:
+                continue
+            if now - fetched_at <= self.ttl:
+                fresh[ticker] = market_cap
+            else:
+                stale[ticker] = market_cap
+        return fresh, stale
+
+    def last_known(self, tickers):
+        """Most recent cached market cap for each of `tickers`, however old"""
+        fresh, stale = self.lookup(tickers)
+        stale.update(fresh)
+        return stale
+
+    def store(self, caps, now=None):
+        """Record freshly fetched market caps"""
+        if not caps:
+            return
+        now = time.time() if now is None else now
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO market_caps (ticker, market_cap, fetched_at) VALUES (?, ?, ?)",
+                [(t, float(cap), now) for t, cap in caps.items()]
+            )
+
+    def evict(self, now=None):
+        """Drop entries older than max_age, returning how many were removed"""
+        now = time.time() if now is None else now
+        with self._connect() as conn:
+            cur = conn.execute("DELETE FROM market_caps WHERE fetched_at < ?", (now - self.max_age,))
+            return cur.rowcount
+
+
+def cached_market_caps(tickers, cache, **kwargs):
+    """
+    Serve market caps from `cache`, looking up only the stale or missing ones.
+
+    Keyword arguments are passed on to fetch_market_caps(). When a lookup
+    fails, the last known value from the cache is used if there is one.
+
+    Returns (caps, errors, stats) where stats has "hits", "misses" and
+    "fallbacks" counts.
+    """
+    tickers = list(tickers)
+    cache.evict()
+    fresh, stale = cache.lookup(tickers)
+
+    to_fetch = [t for t in tickers if t not in fresh]
+    fetched, errors = fetch_market_caps(to_fetch, **kwargs)
+    cache.store(fetched)
+
+    caps = dict(fresh)
+    caps.update(fetched)
+    fallbacks = 0
+    for t in to_fetch:
+        if t not in caps and t in stale:
+            caps[t] = stale[t]
+            fallbacks += 1
+
+    stats = {"hits": len(fresh), "misses": len(to_fetch), "fallbacks": fallbacks}
+    return caps, errors, stats
@@ -0,0 +1,307 @@
+"""
+Stages of the refresh pipeline shared by server.py and fetch_data.py:
+download -> process closes -> market caps -> build output
+-> validate -> write. Downloads and close processing can run in batches with
+download_chunks().
+
+write_output() never leaves a half-written sp500_data.json behind: the new
+file is written and fsynced under a temporary name and renamed over the old
+one, with a sha256 sidecar and a copy kept in a small ring of last good
+files. read_output() checks the checksum and falls back to the ring.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+# Used when a ticker has no market cap and nothing cached
+PLACEHOLDER_MARKET_CAP = 10
+
+INDEX_NAMES = {"SPY": "S&P 500", "QQQ": "NASDAQ 100"}
+
+# Tickers per download batch in the chunked pipeline
+CHUNK_SIZE = 100
+
+# Refuse to publish an output tree when more than this fraction of stocks has no price
+MAX_MISSING_PRICES = 0.2
+
+# Directory next to the data file holding copies of the last good files, and how many are kept
+GOOD_DIR = "last_good"
+GOOD_KEEP = 5
+
+
+class InvalidOutput(ValueError):
+    """An output tree that must not replace the last good one"""
+
+
+def to_yf_ticker(ticker):
+    """Convert BRK-B to BRK.B for yfinance"""
+    return ticker.replace('-', '.')
+
+
+def close_matrix(data, tickers):
+    """
+    The Close column of a batch download as a (dates x tickers) frame,
+    limited to `tickers`, whether or not the download is grouped by ticker.
+    """
+    if data is None or data.empty:
+        return None
+    if data.columns.nlevels > 1:
+        closes = data.xs('Close', axis=1, level=1)
+    else:
+        # A single-ticker download has plain field columns
+        closes = data[['Close']]
+        closes.columns = [tickers[0]]
+    wanted = set(tickers)
+    closes = closes.loc[:, [t in wanted for t in closes.columns]]
+    return closes.loc[:, ~closes.columns.duplicated()]
+
+
+def last_two_valid(values):
+    """
+    Row positions of the last and second-to-last non-NaN value in each
+    column of a 2-D array (-1 where a column has fewer values).
+    """
+    import numpy as np
+
+    rows = np.arange(values.shape[0])[:, None]
+    pos = np.where(np.isnan(values), -1, rows)
+    last = pos.max(axis=0)
+    cols = np.arange(values.shape[1])
+    pos[np.maximum(last, 0), cols] = -1
+    prev = pos.max(axis=0)
+    return last, prev
+
+
+def process_closes(data, tickers):
+    """
+    Compute the latest price and day-over-day change from a batch download,
+    for all tickers in one vectorized pass.
+
+    Returns (results, errors): results maps ticker -> {'price', 'change',
+    'marketCap'} for every ticker with at least two closes, errors maps
+    ticker -> exception for tickers whose change could not be computed.
+    """
+    import numpy as np
+
+    results = {}
+    errors = {}
+    closes = close_matrix(data, tickers)
+    if closes is None or closes.empty:
+        return results, errors
+
+    values = closes.to_numpy(dtype=np.float64, na_value=np.nan)
+    last, prev = last_two_valid(values)
+    cols = np.flatnonzero(prev >= 0)
+    current_price = values[last[cols], cols]
+    prev_close = values[prev[cols], cols]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        change_pct = ((current_price - prev_close) / prev_close) * 100
+    finite = np.isfinite(change_pct)
+
+    names = closes.columns[cols]
+    for yf_ticker, price, change, ok in zip(names, current_price.tolist(), change_pct.tolist(), finite):
+        if not ok:
+            errors[yf_ticker] = ValueError("previous close is zero")
+            continue
+        results[yf_ticker] = {
+            'price': price,
+            'change': change,
+            'marketCap': None
+        }
+    return results, errors
+
+
+def download_chunks(provider, tickers, chunk_size=CHUNK_SIZE, period='5d', on_stage=None, on_closes=None):
+    """
+    Download and process `tickers` in batches of `chunk_size`, yielding
+    (chunk, results, errors) as each batch arrives. Only one batch's
+    DataFrame is alive at a time, so memory is bounded by the chunk size.
+
+    `on_stage(stage, seconds)` is called with how long each batch spent in
+    the 'download' and 'process' stages, and `on_closes(chunk, closes)` with
+    each batch's close matrix (see close_matrix) for callers that keep it.
+    """
+    for i in range(0, len(tickers), chunk_size):
+        chunk = tickers[i:i + chunk_size]
+        start = time.perf_counter()
+        data = provider.download(chunk, period=period)
+        downloaded = time.perf_counter()
+        results, errors = process_closes(data, chunk)
+        if on_closes:
+            on_closes(chunk, close_matrix(data, chunk))
+        del data
+        if on_stage:
+            on_stage('download', downloaded - start)
+            on_stage('process', time.perf_counter() - downloaded)
+        yield chunk, results, errors
+
+
+def build_output(stocks, indices, results, known_caps=None, previous=None):
+    """
+    Build the sector/ticker tree written to sp500_data.json.
+
+    Tickers missing from `results` keep their entry from `previous` (an
+    earlier output tree) when given, which is how partial snapshots show
+    the last values for tickers not fetched yet.
+    """
+    known_caps = known_caps or {}
+    previous = previous or {}
+    previous_indices = previous.get("indices", {})
+    previous_stocks = {
+        stock["ticker"]: stock
+        for sector in previous.get("children", [])
+        for stock in sector.get("children", [])
+    }
+    output = {
+        "name": "S&P 500",
+        "lastUpdated": datetime.now().isoformat(),
+        "indices": {},
+        "children": []
+    }
+
+    # Add index data from batch download (uses historical closes for accuracy)
+    for idx in indices:
+        if idx in results:
+            output["indices"][idx] = {
+                "name": INDEX_NAMES.get(idx, idx),
+                "changePercent": round(results[idx]['change'], 2)
+            }
+        elif idx in previous_indices:
+            output["indices"][idx] = dict(previous_indices[idx])
+
+    for sector_name, sector_stocks in stocks.items():
+        sector = {"name": sector_name, "children": []}
+        for orig_ticker, name in sector_stocks:
+            yf_ticker = to_yf_ticker(orig_ticker)
+            if yf_ticker in results:
+                r = results[yf_ticker]
+                sector["children"].append({
+                    "ticker": orig_ticker,
+                    "name": name,
+                    "marketCap": round(r['marketCap'] or known_caps.get(yf_ticker, PLACEHOLDER_MARKET_CAP), 2),
+                    "price": round(r['price'], 2),
+                    "change": round(r['change'], 2)
+                })
+            elif orig_ticker in previous_stocks:
+                sector["children"].append(dict(previous_stocks[orig_ticker]))
+            else:
+                sector["children"].append({
+                    "ticker": orig_ticker,
+                    "name": name,
+                    "marketCap": round(known_caps.get(yf_ticker, PLACEHOLDER_MARKET_CAP), 2),
+                    "price": None,
+                    "change": None
+                })
+        output["children"].append(sector)
+
+    return output
+
+
+def validate_output(output, max_missing=MAX_MISSING_PRICES):
+    """Raise InvalidOutput if the tree has no stocks or too many without a price"""
+    stocks = [stock for sector in output.get("children", []) for stock in sector.get("children", [])]
+    if not stocks:
+        raise InvalidOutput("no stocks in the output")
+    missing = sum(1 for stock in stocks if stock.get("price") is None)
+    if missing > max_missing * len(stocks):
+        raise InvalidOutput(f"{missing} of {len(stocks)} stocks have no price")
+
+
+def _fsync_dir(directory):
+    """Make a rename in `directory` durable (not supported everywhere)"""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _replace(path, body):
+    """Write `body` to `path` atomically: temp file, fsync, rename"""
+    tmp = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(body)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def write_output(output, path="sp500_data.json", keep=GOOD_KEEP):
+    """
+    Save the output tree as JSON, atomically, with a `path`.sha256 sidecar
+    and a copy in the GOOD_DIR ring (the last `keep` files). Returns the
+    sha256 of what was written.
+    """
+    body = json.dumps(output, indent=2).encode()
+    digest = hashlib.sha256(body).hexdigest()
+    directory = os.path.dirname(os.path.abspath(path))
+
+    # The ring copy goes first, so a crash before the sidecar is updated
+    # still leaves an intact copy of the new file to fall back on
+    if keep:
+        ring = os.path.join(directory, GOOD_DIR)
+        os.makedirs(ring, exist_ok=True)
+        name = f"{datetime.now().strftime('%Y%m%dT%H%M%S%f')}-{digest[:16]}.json"
+        _replace(os.path.join(ring, name), body)
+        for old in sorted(os.listdir(ring))[:-keep]:
+            try:
+                os.remove(os.path.join(ring, old))
+            except OSError:
+                pass
+        _fsync_dir(ring)
+
+    _replace(path, body)
+    _replace(path + ".sha256", f"{digest}  {os.path.basename(path)}\n".encode())
+    _fsync_dir(directory)
+    return digest
+
+
+def _read_checked(path, digest=None):
+    """The valid output tree at `path` whose sha256 starts with `digest`, or None"""
+    try:
+        with open(path, 'rb') as f:
+            body = f.read()
+        if digest and not hashlib.sha256(body).hexdigest().startswith(digest):
+            return None
+        output = json.loads(body)
+        validate_output(output)
+    except (OSError, ValueError):
+        return None
+    return output
+
+
+def read_output(path="sp500_data.json"):
+    """
+    The newest intact output tree: `path` when it matches its sidecar
+    checksum (files without one are only parsed and validated), otherwise
+    the newest good copy in the ring. None if there is none.
+    """
+    digest = None
+    try:
+        with open(path + ".sha256") as f:
+            digest = f.read().split()[0]
+    except (OSError, IndexError):
+        pass
+    output = _read_checked(path, digest)
+    if output is not None:
+        return output
+
+    ring = os.path.join(os.path.dirname(os.path.abspath(path)), GOOD_DIR)
+    try:
+        names = sorted((n for n in os.listdir(ring) if n.endswith('.json')), reverse=True)
+    except OSError:
+        return None
+    for name in names:
+        output = _read_checked(os.path.join(ring, name), name[:-len('.json')].rpartition('-')[2])
+        if output is not None:
+            return output
+    return None
@@ -0,0 +1,287 @@
+"""
+Quote providers for the refresh pipeline.
+
+A provider supplies batch price history (a DataFrame grouped by ticker, the
+shape `yf.download(..., group_by='ticker')` returns) and per-ticker market
+caps in billions. Besides Yahoo via yfinance there is a replay provider that
+serves a recording from disk and a synthetic one for load tests.
+
+make_provider() builds one from a command-line spec:
+    yfinance                  live Yahoo data (default)
+    replay:DIR                recorded data saved with ReplayProvider.save()
+    synthetic[:N]             random data, N tickers in universe()
+"""
+
+import json
+import os
+import random
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+
+from market_caps import yf_market_cap
+from upstream import UpstreamClient, RateLimitError
+
+# Minutes of intraday bars latest() asks for, enough to span a quiet minute or two
+LATEST_LOOKBACK = 15
+
+# Trading days per unit of a yfinance period string ('5d', '3mo', '1y')
+PERIOD_UNITS = {'d': 1, 'wk': 5, 'mo': 21, 'y': 252}
+
+
+def period_days(period):
+    """Approximate trading days in a yfinance period string (5 if unrecognized)"""
+    for unit, days in PERIOD_UNITS.items():
+        if period.endswith(unit) and period[:-len(unit)].isdigit():
+            return int(period[:-len(unit)]) * days
+    return 5
+
+
+class QuoteProvider:
+    """Interface for price history and market-cap sources"""
+
+    def download(self, tickers, period='5d'):
+        """Daily bars for `tickers` as a DataFrame grouped by ticker"""
+        raise NotImplementedError
+
+    def latest(self, tickers, interval='1m'):
+        """The newest intraday bars for `tickers`, shaped like download()"""
+        raise NotImplementedError
+
+    def market_cap(self, ticker):
+        """Market cap of `ticker` in billions, or None if unknown"""
+        raise NotImplementedError
+
+
+class YFinanceProvider(QuoteProvider):
+    """Live data from Yahoo Finance, with every call going through one UpstreamClient"""
+
+    def __init__(self, progress=False, client=None):
+        self.progress = progress
+        self.client = client or UpstreamClient()
+
+    def _download(self, tickers, period):
+        import yfinance as yf
+
+        return yf.download(' '.join(tickers), period=period, group_by='ticker',
+                           progress=self.progress, threads=True)
+
+    def _latest(self, tickers, interval):
+        import yfinance as yf
+
+        start = datetime.now(timezone.utc) - timedelta(minutes=LATEST_LOOKBACK)
+        return yf.download(' '.join(tickers), start=start, interval=interval, group_by='ticker',
+                           progress=False, threads=True)
+
+    def download(self, tickers, period='5d'):
+        return self.client.call(self._download, tickers, period)
+
+    def latest(self, tickers, interval='1m'):
+        return self.client.call(self._latest, tickers, interval)
+
+    def market_cap(self, ticker):
+        return self.client.call(yf_market_cap, ticker)
+
+
+class ReplayProvider(QuoteProvider):
+    """Serves a recorded download and market caps from a directory"""
+
+    PRICES_FILE = "prices.pkl"
+    CAPS_FILE = "market_caps.json"
+
+    def __init__(self, directory):
+        import pandas as pd
+
+        self.directory = directory
+        self.data = pd.read_pickle(os.path.join(directory, self.PRICES_FILE))
+        with open(os.path.join(directory, self.CAPS_FILE)) as f:
+            self.caps = json.load(f)
+
+    @classmethod
+    def save(cls, directory, data, caps):
+        """Record a batch download and {ticker: market cap} dict for later replay"""
+        os.makedirs(directory, exist_ok=True)
+        data.to_pickle(os.path.join(directory, cls.PRICES_FILE))
+        with open(os.path.join(directory, cls.CAPS_FILE), 'w') as f:
+            json.dump(caps, f)
+
+    def download(self, tickers, period='5d'):
+        recorded = set(self.data.columns.get_level_values(0))
+        return self.data[[t for t in tickers if t in recorded]]
+
+    def latest(self, tickers, interval='1m'):
+        # The recording's last bar stands in for the newest intraday one
+        return self.download(tickers).iloc[-1:]
+
+    def market_cap(self, ticker):
+        return self.caps.get(ticker)
+
+
+class RecordingProvider(QuoteProvider):
+    """Passes calls through to another provider and keeps the downloads for ReplayProvider.save()"""
+
+    def __init__(self, provider):
+        self.provider = provider
+        self.frames = []
+
+    def download(self, tickers, period='5d'):
+        data = self.provider.download(tickers, period=period)
+        self.frames.append(data)
+        return data
+
+    def latest(self, tickers, interval='1m'):
+        return self.provider.latest(tickers, interval=interval)
+
+    def market_cap(self, ticker):
+        return self.provider.market_cap(ticker)
+
+    def recorded_data(self):
+        """Every download so far, joined into one frame"""
+        import pandas as pd
+
+        frames = [f for f in self.frames if f is not None and not f.empty]
+        if not frames:
+            return pd.DataFrame()
+        data = pd.concat(frames, axis=1)
+        return data.loc[:, ~data.columns.duplicated()]
+
+
+class SyntheticProvider(QuoteProvider):
+    """
+    Random but repeatable data for any set of tickers.
+
+    `latency` seconds are slept per call (once per batch download and once
+    per market-cap lookup), and each ticker fails with probability
+    `error_rate`: it is left out of downloads and its market-cap lookup
+    raises. `universe_size` sets how many tickers universe() returns.
+
+    With `rate_limit` set it also throttles like a real quote service: calls
+    beyond `rate_limit` per second raise RateLimitError, and a caller that
+    keeps calling through that many rejections in one second is blocked
+    outright for `block_time` seconds.
+    """
+
+    SECTORS = [
+        "Technology", "Healthcare", "Financials", "Consumer Discretionary",
+        "Communication Services", "Consumer Staples", "Energy", "Industrials",
+        "Utilities", "Real Estate", "Materials"
+    ]
+
+    def __init__(self, latency=0.0, error_rate=0.0, universe_size=220, seed=0,
+                 rate_limit=None, block_time=10.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.universe_size = universe_size
+        self.seed = seed
+        self.rate_limit = rate_limit
+        self.block_time = block_time
+        self._lock = threading.Lock()
+        self._window = None
+        self._calls = 0
+        self._rejected = 0
+        self._blocked_until = 0.0
+
+    def universe(self):
+        """A {sector: [(ticker, name), ...]} universe of universe_size tickers"""
+        stocks = {sector: [] for sector in self.SECTORS}
+        for i in range(self.universe_size):
+            sector = self.SECTORS[i % len(self.SECTORS)]
+            stocks[sector].append((f"SYN{i:04d}", f"Synthetic Co. {i}"))
+        return stocks
+
+    def _rng(self, ticker):
+        return random.Random(zlib.crc32(ticker.encode()) ^ self.seed)
+
+    def _fails(self, ticker):
+        return self._rng(ticker + "#err").random() < self.error_rate
+
+    def _throttle(self):
+        """Count a call against rate_limit, raising RateLimitError when over it"""
+        if self.rate_limit is None:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if now < self._blocked_until:
+                raise RateLimitError("429 Too Many Requests (blocked)")
+            window = int(now)
+            if window != self._window:
+                self._window, self._calls, self._rejected = window, 0, 0
+            self._calls += 1
+            if self._calls > self.rate_limit:
+                self._rejected += 1
+                if self._rejected >= self.rate_limit:
+                    self._blocked_until = now + self.block_time
+                raise RateLimitError("429 Too Many Requests")
+
+    def download(self, tickers, period='5d'):
+        import pandas as pd
+
+        self._throttle()
+        if self.latency:
+            time.sleep(self.latency)
+
+        days = period_days(period)
+        index = pd.bdate_range(end=pd.Timestamp.today().normalize(), periods=days)
+        return self._frame({t: self._closes(t, days) for t in tickers if not self._fails(t)}, index)
+
+    def latest(self, tickers, interval='1m'):
+        import pandas as pd
+
+        self._throttle()
+        if self.latency:
+            time.sleep(self.latency)
+
+        # One bar for the current minute, drifting a little from today's close
+        minute = pd.Timestamp.now().floor('min')
+        closes = {}
+        for ticker in tickers:
+            if self._fails(ticker):
+                continue
+            drift = self._rng(f"{ticker}#{minute.isoformat()}").gauss(0, 0.003)
+            closes[ticker] = self._closes(ticker, 5)[-1:] * (1 + drift)
+        return self._frame(closes, pd.DatetimeIndex([minute]))
+
+    def _closes(self, ticker, days):
+        import numpy as np
+
+        # Walk back from a fixed latest close, so every period ends at the same price
+        rng = self._rng(ticker)
+        last = rng.uniform(10, 1000)
+        steps = np.array([1.0] + [1 + rng.gauss(0, 0.015) for _ in range(days - 1)])
+        return (last / np.cumprod(steps))[::-1]
+
+    def _frame(self, closes, index):
+        """A download()-shaped frame from {ticker: close array}"""
+        import numpy as np
+        import pandas as pd
+
+        frames = {}
+        for ticker, close in closes.items():
+            frames[ticker] = pd.DataFrame({
+                'Open': close, 'High': close * 1.01, 'Low': close * 0.99,
+                'Close': close, 'Volume': np.full(len(close), 1_000_000)
+            }, index=index)
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames, axis=1)
+
+    def market_cap(self, ticker):
+        self._throttle()
+        if self.latency:
+            time.sleep(self.latency)
+        if self._fails(ticker):
+            raise ConnectionError(f"synthetic failure for {ticker}")
+        return self._rng(ticker + "#cap").uniform(5, 3000)
+
+
+def make_provider(spec):
+    """Build a provider from a spec such as "yfinance", "replay:DIR" or "synthetic:500" """
+    name, _, arg = spec.partition(':')
+    if name == 'yfinance':
+        return YFinanceProvider()
+    if name == 'replay':
+        return ReplayProvider(arg)
+    if name == 'synthetic':
+        return SyntheticProvider(universe_size=int(arg) if arg else 220)
+    raise ValueError(f"Unknown provider: {spec}")
@@ -0,0 +1,109 @@
+"""
+Background refresh scheduling.
+
+SingleFlight makes sure only one refresh runs at a time no matter how many
+triggers fire; RefreshScheduler triggers it on a cadence during US market
+hours and backs off while the market is closed.
+"""
+
+import threading
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+MARKET_TZ = ZoneInfo("America/New_York")
+
+# Regular session in minutes after midnight Eastern (9:30 to 16:00),
+# matching updateRaccoon() in index.html
+MARKET_OPEN = 9 * 60 + 30
+MARKET_CLOSE = 16 * 60
+
+# Seconds between refreshes while the market is open / closed
+OPEN_INTERVAL = 300
+CLOSED_INTERVAL = 4 * 3600
+
+
+def market_is_open(now=None):
+    """Whether the US stock market's regular session is in progress"""
+    now = (now or datetime.now(MARKET_TZ)).astimezone(MARKET_TZ)
+    mins = now.hour * 60 + now.minute
+    return now.weekday() < 5 and MARKET_OPEN <= mins < MARKET_CLOSE
+
+
+def seconds_until_open(now=None):
+    """Seconds until the next regular session starts (0 if it's open now)"""
+    now = (now or datetime.now(MARKET_TZ)).astimezone(MARKET_TZ)
+    if market_is_open(now):
+        return 0
+    candidate = now.replace(hour=MARKET_OPEN // 60, minute=MARKET_OPEN % 60, second=0, microsecond=0)
+    if candidate <= now:
+        candidate += timedelta(days=1)
+    while candidate.weekday() >= 5:
+        candidate += timedelta(days=1)
+    return (candidate - now).total_seconds()
+
+
+class SingleFlight:
+    """Runs `fn` on a background thread, at most one call at a time"""
+
+    def __init__(self, fn):
+        self.fn = fn
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._done.set()
+
+    def running(self):
+        return not self._done.is_set()
+
+    def start(self, fn=None):
+        """
+        Start a run (of `fn` instead of the default, if given) unless one is
+        in flight; returns True if this call started it
+        """
+        with self._lock:
+            if not self._done.is_set():
+                return False
+            self._done = threading.Event()
+            done = self._done
+        thread = threading.Thread(target=self._run, args=(fn or self.fn, done), daemon=True)
+        thread.start()
+        return True
+
+    def wait(self, timeout=None):
+        """Block until the in-flight run (if any) finishes"""
+        return self._done.wait(timeout)
+
+    def _run(self, fn, done):
+        try:
+            fn()
+        finally:
+            done.set()
+
+
+class RefreshScheduler:
+    """Triggers a SingleFlight refresh every `open_interval` seconds in market hours"""
+
+    def __init__(self, flight, open_interval=OPEN_INTERVAL, closed_interval=CLOSED_INTERVAL):
+        self.flight = flight
+        self.open_interval = open_interval
+        self.closed_interval = closed_interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def next_delay(self, now=None):
+        """Seconds to wait before the next scheduled refresh"""
+        if market_is_open(now):
+            return self.open_interval
+        # Closed: check back at the next open, or after closed_interval if sooner
+        return max(self.open_interval, min(self.closed_interval, seconds_until_open(now)))
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.flight.start()
+            self._stop.wait(self.next_delay())
@@ -3,121 +3,128 @@
 S&P 500 Treemap Server
 Serves the HTML and provides a /refresh endpoint to fetch new stock data.
 
-Usage: python3 server.py
+Usage: python3 server.py [--port 8000] [--workers 256] [--provider yfinance|replay:DIR|synthetic]
+                         [--refresh-interval 300] [--closed-interval 14400] [--universe sp500_universe.csv]
+                         [--live] [--live-interval 60] [--shared [DIR]] [--role worker|reader]
+                         [--processes N]
 Then open http://localhost:8000
 """
 
 import json
 import http.server
 import socketserver
-from urllib.parse import urlparse
-import yfinance as yf
+from urllib.parse import urlparse, parse_qs, unquote
+import gzip
+import argparse
+import os
+import subprocess
+import sys
 from datetime import datetime
 import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+from market_caps import MarketCapCache, cached_market_caps, REFRESH_TIMEOUT as MARKET_CAP_TIMEOUT
+from pipeline import (download_chunks, build_output, validate_output, write_output,
+                      InvalidOutput, CHUNK_SIZE)
+from providers import YFinanceProvider, make_provider
+from snapshot import SnapshotStore, accepts_gzip
+from columnar import accepts_columnar, CONTENT_TYPE as COLUMNAR_CONTENT_TYPE
+from indexes import MAX_LIMIT
+from layout import LayoutCache
+from events import EventHub, format_event
+from history import HistoryStore, HISTORY_DIR, parse_time
+from scheduler import SingleFlight, RefreshScheduler, OPEN_INTERVAL, CLOSED_INTERVAL
+from universe import Universe, UNIVERSE_FILE
+from metrics import Registry, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from live import LiveQuotes, LIVE_INTERVAL
+from shared import SharedSegment, SHARED_DIR, POLL_INTERVAL as SHARED_POLL_INTERVAL
+from horizons import HorizonCloses, HORIZONS, DAY, LONG_PERIOD
 
 PORT = 8000
 
-# S&P 500 stocks organized by sector
-SP500_STOCKS = {
-    "Technology": [
-        ("AAPL", "Apple Inc."), ("MSFT", "Microsoft Corp."), ("NVDA", "NVIDIA Corp."),
-        ("AVGO", "Broadcom Inc."), ("ORCL", "Oracle Corp."), ("CRM", "Salesforce Inc."),
-        ("CSCO", "Cisco Systems"), ("ACN", "Accenture"), ("IBM", "IBM Corp."),
-        ("ADBE", "Adobe Inc."), ("AMD", "AMD Inc."), ("INTC", "Intel Corp."),
-        ("QCOM", "Qualcomm"), ("TXN", "Texas Instruments"), ("INTU", "Intuit Inc."),
-        ("AMAT", "Applied Materials"), ("NOW", "ServiceNow"), ("MU", "Micron Technology"),
-        ("LRCX", "Lam Research"), ("ADI", "Analog Devices")
-    ],
-    "Healthcare": [
-        ("UNH", "UnitedHealth Group"), ("JNJ", "Johnson & Johnson"), ("LLY", "Eli Lilly"),
-        ("MRK", "Merck & Co."), ("ABBV", "AbbVie Inc."), ("PFE", "Pfizer Inc."),
-        ("TMO", "Thermo Fisher"), ("ABT", "Abbott Labs"), ("DHR", "Danaher Corp."),
-        ("BMY", "Bristol-Myers"), ("AMGN", "Amgen Inc."), ("MDT", "Medtronic"),
-        ("GILD", "Gilead Sciences"), ("ISRG", "Intuitive Surgical"), ("VRTX", "Vertex Pharma"),
-        ("CVS", "CVS Health"), ("CI", "Cigna Group"), ("ELV", "Elevance Health"),
-        ("SYK", "Stryker Corp."), ("REGN", "Regeneron")
-    ],
-    "Financials": [
-        ("BRK-B", "Berkshire Hathaway"), ("JPM", "JPMorgan Chase"), ("V", "Visa Inc."),
-        ("MA", "Mastercard"), ("BAC", "Bank of America"), ("WFC", "Wells Fargo"),
-        ("GS", "Goldman Sachs"), ("MS", "Morgan Stanley"), ("BLK", "BlackRock"),
-        ("AXP", "American Express"), ("SPGI", "S&P Global"), ("C", "Citigroup"),
-        ("SCHW", "Charles Schwab"), ("CB", "Chubb Ltd."), ("PGR", "Progressive Corp."),
-        ("MMC", "Marsh McLennan"), ("ICE", "Intercontinental Ex"), ("USB", "U.S. Bancorp"),
-        ("AON", "Aon plc"), ("CME", "CME Group")
-    ],
-    "Consumer Discretionary": [
-        ("AMZN", "Amazon.com"), ("TSLA", "Tesla Inc."), ("HD", "Home Depot"),
-        ("MCD", "McDonald's Corp."), ("NKE", "Nike Inc."), ("LOW", "Lowe's Cos."),
-        ("SBUX", "Starbucks"), ("TJX", "TJX Companies"), ("BKNG", "Booking Holdings"),
-        ("CMG", "Chipotle"), ("MAR", "Marriott Intl"), ("ORLY", "O'Reilly Auto"),
-        ("GM", "General Motors"), ("F", "Ford Motor"), ("AZO", "AutoZone"),
-        ("ROST", "Ross Stores"), ("DHI", "D.R. Horton"), ("LEN", "Lennar Corp."),
-        ("YUM", "Yum! Brands"), ("EBAY", "eBay Inc.")
-    ],
-    "Communication Services": [
-        ("GOOGL", "Alphabet Inc."), ("META", "Meta Platforms"), ("NFLX", "Netflix Inc."),
-        ("DIS", "Walt Disney"), ("CMCSA", "Comcast Corp."), ("VZ", "Verizon"),
-        ("T", "AT&T Inc."), ("TMUS", "T-Mobile US"), ("CHTR", "Charter Comm."),
-        ("WBD", "Warner Bros."), ("EA", "Electronic Arts"), ("TTWO", "Take-Two"),
-        ("OMC", "Omnicom Group"), ("LYV", "Live Nation"), ("FOX", "Fox Corp."),
-        ("NWSA", "News Corp."), ("MTCH", "Match Group")
-    ],
-    "Consumer Staples": [
-        ("WMT", "Walmart Inc."), ("PG", "Procter & Gamble"), ("COST", "Costco"),
-        ("KO", "Coca-Cola"), ("PEP", "PepsiCo"), ("PM", "Philip Morris"),
-        ("MO", "Altria Group"), ("MDLZ", "Mondelez"), ("CL", "Colgate-Palmolive"),
-        ("EL", "Estee Lauder"), ("KMB", "Kimberly-Clark"), ("GIS", "General Mills"),
-        ("SYY", "Sysco Corp."), ("HSY", "Hershey Co."), ("KHC", "Kraft Heinz"),
-        ("STZ", "Constellation Brands"), ("KR", "Kroger Co."), ("CAG", "Conagra Brands")
-    ],
-    "Energy": [
-        ("XOM", "Exxon Mobil"), ("CVX", "Chevron Corp."), ("COP", "ConocoPhillips"),
-        ("EOG", "EOG Resources"), ("SLB", "Schlumberger"), ("MPC", "Marathon Petroleum"),
-        ("PSX", "Phillips 66"), ("VLO", "Valero Energy"), ("OXY", "Occidental Petro"),
-        ("WMB", "Williams Cos."), ("KMI", "Kinder Morgan"), ("HAL", "Halliburton"),
-        ("DVN", "Devon Energy"), ("BKR", "Baker Hughes"), ("FANG", "Diamondback Energy"),
-        ("TRGP", "Targa Resources"), ("OKE", "ONEOK Inc.")
-    ],
-    "Industrials": [
-        ("GE", "GE Aerospace"), ("CAT", "Caterpillar"), ("UNP", "Union Pacific"),
-        ("RTX", "RTX Corp."), ("HON", "Honeywell"), ("BA", "Boeing Co."),
-        ("DE", "Deere & Co."), ("LMT", "Lockheed Martin"), ("UPS", "United Parcel"),
-        ("ADP", "ADP Inc."), ("ETN", "Eaton Corp."), ("NOC", "Northrop Grumman"),
-        ("GD", "General Dynamics"), ("WM", "Waste Management"), ("ITW", "Illinois Tool Works"),
-        ("FDX", "FedEx Corp."), ("EMR", "Emerson Electric"), ("NSC", "Norfolk Southern"),
-        ("CSX", "CSX Corp."), ("PH", "Parker Hannifin")
-    ],
-    "Utilities": [
-        ("NEE", "NextEra Energy"), ("SO", "Southern Co."), ("DUK", "Duke Energy"),
-        ("SRE", "Sempra Energy"), ("AEP", "American Electric"), ("D", "Dominion Energy"),
-        ("EXC", "Exelon Corp."), ("XEL", "Xcel Energy"), ("PCG", "PG&E Corp."),
-        ("ED", "Con Edison"), ("WEC", "WEC Energy"), ("EIX", "Edison Intl"),
-        ("AWK", "American Water"), ("DTE", "DTE Energy"), ("PPL", "PPL Corp."),
-        ("ES", "Eversource"), ("FE", "FirstEnergy"), ("AEE", "Ameren Corp."),
-        ("CMS", "CMS Energy"), ("CNP", "CenterPoint")
-    ],
-    "Real Estate": [
-        ("PLD", "Prologis"), ("AMT", "American Tower"), ("EQIX", "Equinix"),
-        ("CCI", "Crown Castle"), ("PSA", "Public Storage"), ("SPG", "Simon Property"),
-        ("WELL", "Welltower"), ("DLR", "Digital Realty"), ("O", "Realty Income"),
-        ("VICI", "VICI Properties"), ("AVB", "AvalonBay"), ("EQR", "Equity Residential"),
-        ("SBAC", "SBA Comm."), ("WY", "Weyerhaeuser"), ("ARE", "Alexandria RE"),
-        ("EXR", "Extra Space"), ("MAA", "Mid-America Apt"), ("VTR", "Ventas Inc."),
-        ("IRM", "Iron Mountain"), ("CBRE", "CBRE Group")
-    ],
-    "Materials": [
-        ("LIN", "Linde plc"), ("APD", "Air Products"), ("SHW", "Sherwin-Williams"),
-        ("FCX", "Freeport-McMoRan"), ("ECL", "Ecolab Inc."), ("NUE", "Nucor Corp."),
-        ("NEM", "Newmont Corp."), ("DOW", "Dow Inc."), ("CTVA", "Corteva"),
-        ("DD", "DuPont"), ("PPG", "PPG Industries"), ("VMC", "Vulcan Materials"),
-        ("MLM", "Martin Marietta"), ("ALB", "Albemarle"), ("IFF", "IFF"),
-        ("LYB", "LyondellBasell"), ("CF", "CF Industries"), ("MOS", "Mosaic Co."),
-        ("CE", "Celanese"), ("BALL", "Ball Corp.")
-    ]
-}
+# Worker threads serving connections, and seconds an idle keep-alive connection is held
+WORKERS = 256
+KEEPALIVE_TIMEOUT = 5
+
+# Publish partial snapshots while a refresh downloads its chunks (see
+# pipeline.CHUNK_SIZE), at most one per PARTIAL_INTERVAL seconds so displays
+# don't redraw after every chunk
+PUBLISH_PARTIAL = True
+PARTIAL_INTERVAL = 5.0
+
+# Where refreshes get their data (see providers.make_provider)
+PROVIDER = YFinanceProvider()
+
+DATA_FILE = "sp500_data.json"
+
+# Latest dataset held in memory for serving
+SNAPSHOTS = SnapshotStore()
+
+# Server-Sent Events subscribers of /api/events
+EVENTS = EventHub()
+
+# Every published snapshot, for /api/history (set up in __main__)
+HISTORY = None
 
-INDICES = ["SPY", "QQQ"]
+# Treemap layouts per (snapshot version, viewport bucket) for /api/layout
+LAYOUTS = LayoutCache()
+
+# Previous closes for intraday live updates between full refreshes (set up by --live)
+LIVE = None
+
+
+# Shared snapshot directory of a multi-process setup (set up by --shared). The
+# worker refreshes and publishes into it; readers only follow it.
+SHARED = None
+SHARED_READER = False
+
+# Process that started this reader with --processes; the reader exits with it
+PARENT_PID = None
+
+# S&P 500 constituents by sector (replaced by --universe)
+UNIVERSE = Universe.load()
+
+# Closes of the day's long download, for the 1W/1M/3M/YTD views of /api/data?horizon=
+HORIZON_CLOSES = HorizonCloses(UNIVERSE)
+
+# Exposed at /api/metrics
+METRICS = Registry()
+REFRESH_SECONDS = METRICS.histogram(
+    'treemap_refresh_seconds', "Duration of whole refreshes, full or live", ['mode', 'result'])
+REFRESH_STAGE_SECONDS = METRICS.histogram(
+    'treemap_refresh_stage_seconds', "Time spent per chunk in each refresh stage", ['stage'])
+TICKER_ERRORS = METRICS.counter(
+    'treemap_ticker_errors_total', "Tickers that failed during a refresh, by stage and error class",
+    ['stage', 'error'])
+HTTP_SECONDS = METRICS.histogram(
+    'treemap_http_request_seconds', "Time to handle HTTP requests", ['route'])
+HTTP_REQUESTS = METRICS.counter(
+    'treemap_http_requests_total', "HTTP requests handled", ['route', 'status'])
+HTTP_BYTES = METRICS.counter(
+    'treemap_http_response_bytes_total', "Response body bytes sent", ['route'])
+METRICS.gauge('treemap_snapshot_age_seconds', "Seconds since the current snapshot was published",
+              fn=lambda: time.time() - SNAPSHOTS.current().created if SNAPSHOTS.current() else None)
+METRICS.gauge('treemap_snapshot_version', "Version of the current snapshot",
+              fn=lambda: SNAPSHOTS.current().version if SNAPSHOTS.current() else None)
+METRICS.gauge('treemap_refresh_in_progress', "1 while a refresh is running",
+              fn=lambda: int(refresh_status["is_refreshing"]))
+METRICS.gauge('treemap_event_subscribers', "Connected /api/events clients",
+              fn=lambda: EVENTS.subscriber_count())
+METRICS.gauge('treemap_layout_cache_hits', "/api/layout requests answered from the layout cache",
+              fn=lambda: LAYOUTS.hits)
+METRICS.gauge('treemap_layout_cache_misses', "/api/layout requests that computed a layout",
+              fn=lambda: LAYOUTS.misses)
+METRICS.gauge('treemap_upstream_rate_limit', "Upstream calls per second the rate limiter allows",
+              fn=lambda: PROVIDER.client.limiter.rate if hasattr(PROVIDER, 'client') else None)
+METRICS.gauge('treemap_upstream_circuit_open', "1 while the upstream circuit breaker is failing calls fast",
+              fn=lambda: int(PROVIDER.client.breaker.state() == 'open') if hasattr(PROVIDER, 'client') else None)
+
+# Routes with their own latency series; everything else is "static"
+ROUTES = ('/api/refresh', '/api/status', '/api/events', '/api/data', '/api/history',
+          '/api/history/sector', '/api/metrics', '/api/movers', '/api/search', '/api/sectors',
+          '/api/layout', '/' + DATA_FILE)
 
 # Track refresh status
 refresh_status = {
@@ -125,190 +132,707 @@ refresh_status = {
     "last_refresh": None,
     "progress": 0,
     "total": 0,
-    "message": ""
+    "message": "",
+    "cache_hits": 0,
+    "cache_misses": 0
 }
 
 
-def fetch_stock_data():
+def update_status(**fields):
+    """Update refresh_status and push the new state to event subscribers (and reader processes)"""
+    refresh_status.update(fields)
+    if SHARED is not None and not SHARED_READER:
+        SHARED.write_status(refresh_status)
+    EVENTS.publish('progress', refresh_status)
+
+
+def publish_snapshot(data, references=None, partial=False):
+    """Make `data` the current snapshot here, for reader processes and for event subscribers"""
+    snapshot = SNAPSHOTS.publish(data, references, partial)
+    if SHARED is not None:
+        SHARED.publish(snapshot, partial)
+    EVENTS.publish('snapshot', snapshot_event(snapshot, partial=partial))
+    return snapshot
+
+
+def count_ticker_errors(stage, errors):
+    for e in errors.values():
+        TICKER_ERRORS.inc(stage=stage, error=type(e).__name__)
+
+
+def record_history(output):
+    if HISTORY is not None:
+        try:
+            HISTORY.append(output)
+        except Exception as e:
+            print(f"  Could not record history: {e}")
+
+
+def fetch_stock_data(provider=None):
     """Fetch all stock data and save to JSON"""
     global refresh_status
+    provider = provider or PROVIDER
     
-    refresh_status["is_refreshing"] = True
-    refresh_status["progress"] = 0
-    refresh_status["message"] = "Starting data fetch..."
+    update_status(is_refreshing=True, progress=0, message="Starting data fetch...")
+    started = time.perf_counter()
+    result = 'error'
+    # Set once a partial snapshot has replaced `previous` for readers
+    previous = None
+    partial_published = False
     
     try:
-        # Collect all tickers
-        all_tickers = []
-        ticker_info = {}
+        # All yfinance symbols, indices last
+        all_tickers = UNIVERSE.symbols()
+        total = len(all_tickers)
+        update_status(total=total, message=f"Fetching {total} tickers...")
         
-        for sector_name, stocks in SP500_STOCKS.items():
-            for ticker, name in stocks:
-                yf_ticker = ticker.replace('-', '.')
-                all_tickers.append(yf_ticker)
-                ticker_info[yf_ticker] = (ticker, name, sector_name)
+        cap_cache = MarketCapCache()
         
-        all_tickers.extend(INDICES)
-        refresh_status["total"] = len(all_tickers)
-        refresh_status["message"] = f"Fetching {len(all_tickers)} tickers..."
+        # Last known caps for tickers that come back without one
+        known_caps = cap_cache.last_known(list(UNIVERSE.by_symbol))
         
-        # Fetch all data
-        tickers_str = ' '.join(all_tickers)
-        data = yf.download(tickers_str, period='5d', group_by='ticker', progress=False, threads=True)
+        # Tickers not fetched yet keep their last values in partial snapshots.
+        # Without a last good snapshot there is nothing to go back to if the
+        # refresh fails, so no partials are published then.
+        previous = SNAPSHOTS.current().data if SNAPSHOTS.current() else None
         
-        refresh_status["progress"] = 40
-        refresh_status["message"] = "Processing price data..."
+        # The first full refresh of the day downloads a year of closes for the
+        # horizon views; later ones only need the last few days
+        long_download = not HORIZON_CLOSES.current()
+        HORIZON_CLOSES.begin()
         
-        # Process price results
+        # Download, process and fetch caps batch by batch, so memory stays
+        # bounded by the chunk size and readers see progress as it happens
         results = {}
-        for yf_ticker in all_tickers:
-            try:
-                if len(all_tickers) == 1:
-                    ticker_data = data
-                else:
-                    ticker_data = data[yf_ticker] if yf_ticker in data.columns.get_level_values(0) else None
-                
-                if ticker_data is not None and not ticker_data.empty:
-                    closes = ticker_data['Close'].dropna()
-                    if len(closes) >= 2:
-                        current_price = closes.iloc[-1]
-                        prev_close = closes.iloc[-2]
-                        change_pct = ((current_price - prev_close) / prev_close) * 100
-                        
-                        results[yf_ticker] = {
-                            'price': float(current_price),
-                            'change': float(change_pct),
-                            'marketCap': 0
-                        }
-            except Exception:
-                pass
-        
-        refresh_status["progress"] = 60
-        refresh_status["message"] = "Fetching market caps..."
-        
-        # Fetch market caps (need to do this separately)
-        stock_tickers = [t for t in all_tickers if t not in INDICES]
-        for i, yf_ticker in enumerate(stock_tickers):
-            if yf_ticker in results:
-                try:
-                    ticker = yf.Ticker(yf_ticker)
-                    info = ticker.fast_info
-                    market_cap = info.get('marketCap', 0)
-                    if market_cap:
-                        results[yf_ticker]['marketCap'] = market_cap / 1e9  # Convert to billions
-                except Exception:
-                    pass
+        cache_hits = cache_misses = 0
+        done = 0
+        last_partial = time.monotonic()
+        stage_timer = lambda stage, seconds: REFRESH_STAGE_SECONDS.observe(seconds, stage=stage)
+        for chunk, chunk_results, errors in download_chunks(
+                provider, all_tickers, CHUNK_SIZE, period=LONG_PERIOD if long_download else '5d',
+                on_stage=stage_timer, on_closes=HORIZON_CLOSES.add if long_download else None):
+            count_ticker_errors('process', errors)
+            for yf_ticker in chunk:
+                if yf_ticker not in chunk_results and yf_ticker not in errors:
+                    TICKER_ERRORS.inc(stage='download', error='NoData')
+            
+            stock_tickers = [t for t in chunk if t in UNIVERSE.by_symbol and t in chunk_results]
+            
+            def on_progress(fetched, count, done=done):
+                update_status(progress=int(((done + len(chunk) * fetched / count) / total) * 85),
+                              message=f"Fetching market caps... {done + fetched}/{total}")
             
-            # Update progress every 20 stocks
-            if i % 20 == 0:
-                pct = 60 + int((i / len(stock_tickers)) * 20)
-                refresh_status["progress"] = pct
-                refresh_status["message"] = f"Fetching market caps... {i}/{len(stock_tickers)}"
+            with REFRESH_STAGE_SECONDS.time(stage='market_caps'):
+                caps, errors, cache_stats = cached_market_caps(stock_tickers, cap_cache,
+                                                               fetch_one=provider.market_cap,
+                                                               timeout=MARKET_CAP_TIMEOUT,
+                                                               progress=on_progress)
+            count_ticker_errors('market_caps', errors)
+            for yf_ticker, market_cap in caps.items():
+                chunk_results[yf_ticker]['marketCap'] = market_cap
+            results.update(chunk_results)
+            
+            cache_hits += cache_stats["hits"]
+            cache_misses += cache_stats["misses"]
+            done += len(chunk)
+            update_status(progress=int((done / total) * 85), message=f"Fetched {done}/{total} tickers...",
+                          cache_hits=cache_hits, cache_misses=cache_misses)
+            
+            if (PUBLISH_PARTIAL and previous is not None and done < total
+                    and time.monotonic() - last_partial >= PARTIAL_INTERVAL):
+                partial = build_output(UNIVERSE.stocks, UNIVERSE.indices, results, known_caps, previous)
+                publish_snapshot(partial, partial=True)
+                partial_published = True
+                last_partial = time.monotonic()
         
-        refresh_status["progress"] = 85
-        refresh_status["message"] = "Building output..."
+        update_status(progress=85, message="Building output...")
         
-        # Build output
-        output = {
-            "name": "S&P 500",
-            "lastUpdated": datetime.now().isoformat(),
-            "indices": {},
-            "children": []
-        }
+        with REFRESH_STAGE_SECONDS.time(stage='build'):
+            output = build_output(UNIVERSE.stocks, UNIVERSE.indices, results, known_caps)
         
-        # Add index data from batch download (uses historical closes for accuracy)
-        for idx in INDICES:
-            if idx in results:
-                output["indices"][idx] = {
-                    "name": "S&P 500" if idx == "SPY" else "NASDAQ 100",
-                    "changePercent": round(results[idx]['change'], 2)
-                }
+        # Publish nothing when too many prices are missing; readers go back
+        # to the last good dataset if partial snapshots replaced it
+        try:
+            validate_output(output)
+        except InvalidOutput as e:
+            if partial_published:
+                publish_snapshot(previous)
+            result = 'rejected'
+            serving = "Still serving the last good data." if previous is not None else "No data to serve yet."
+            update_status(progress=100, message=f"Refresh rejected: {e}. {serving}")
+            return
         
-        for sector_name, stocks in SP500_STOCKS.items():
-            sector = {"name": sector_name, "children": []}
-            for orig_ticker, name in stocks:
-                yf_ticker = orig_ticker.replace('-', '.')
-                if yf_ticker in results:
-                    r = results[yf_ticker]
-                    sector["children"].append({
-                        "ticker": orig_ticker,
-                        "name": name,
-                        "marketCap": round(r.get('marketCap', 10), 2),
-                        "price": round(r['price'], 2),
-                        "change": round(r['change'], 2)
-                    })
-                else:
-                    sector["children"].append({
-                        "ticker": orig_ticker,
-                        "name": name,
-                        "marketCap": 10,
-                        "price": None,
-                        "change": None
-                    })
-            output["children"].append(sector)
+        if long_download:
+            with REFRESH_STAGE_SECONDS.time(stage='horizons'):
+                HORIZON_CLOSES.finish()
         
-        # Save
-        with open("sp500_data.json", 'w') as f:
-            json.dump(output, f, indent=2)
+        # Save, then swap the new snapshot in for readers
+        with REFRESH_STAGE_SECONDS.time(stage='write'):
+            write_output(output, DATA_FILE)
+            publish_snapshot(output, HORIZON_CLOSES.references)
+            partial_published = False
         
-        refresh_status["progress"] = 100
-        refresh_status["message"] = f"Done! {len(results)} stocks updated."
-        refresh_status["last_refresh"] = datetime.now().isoformat()
+        update_status(progress=100, message=f"Done! {len(results)} stocks updated.",
+                      last_refresh=datetime.now().isoformat())
+        
+        record_history(output)
+        if LIVE is not None:
+            LIVE.seed(results, known_caps)
+        result = 'ok'
         
     except Exception as e:
+        # Same as a rejected refresh: don't leave a partial snapshot current
+        if partial_published:
+            publish_snapshot(previous)
         refresh_status["message"] = f"Error: {str(e)}"
     finally:
-        refresh_status["is_refreshing"] = False
+        REFRESH_SECONDS.observe(time.perf_counter() - started, mode='full', result=result)
+        update_status(is_refreshing=False)
+
+
+def poll_live(provider=None):
+    """Update prices from the newest intraday bar, keeping the last full refresh's previous closes"""
+    provider = provider or PROVIDER
+    started = time.perf_counter()
+    result = 'error'
+    
+    try:
+        with REFRESH_STAGE_SECONDS.time(stage='live'):
+            prices = LIVE.poll(provider, UNIVERSE.symbols(), CHUNK_SIZE)
+        output, updated = LIVE.apply(SNAPSHOTS.current().data, prices)
+        if updated:
+            write_output(output, DATA_FILE)
+            publish_snapshot(output)
+            record_history(output)
+        update_status(message=f"Live update: {updated} of {len(prices)} prices changed.",
+                      last_refresh=datetime.now().isoformat())
+        result = 'ok'
+    except Exception as e:
+        update_status(message=f"Error: {str(e)}")
+    finally:
+        REFRESH_SECONDS.observe(time.perf_counter() - started, mode='live', result=result)
+
+
+def scheduled_refresh():
+    """A live update when today's previous closes are known, otherwise a full refresh"""
+    if LIVE is not None and LIVE.current() and SNAPSHOTS.current():
+        poll_live()
+    else:
+        fetch_stock_data()
+
+
+# Every refresh trigger goes through here so only one fetch runs at a time
+REFRESH = SingleFlight(scheduled_refresh)
+
+
+def follow_worker(interval=SHARED_POLL_INTERVAL):
+    """Reader process: adopt each snapshot and status update the worker publishes"""
+    version = status = None
+    while True:
+        if PARENT_PID is not None and os.getppid() != PARENT_PID:
+            print("Worker process exited, stopping")
+            os._exit(0)
+        try:
+            latest, _, latest_status = SHARED.read()
+            if latest_status is not None and latest_status != status:
+                status = latest_status
+                refresh_status.update(status)
+                EVENTS.publish('progress', refresh_status)
+            if latest and latest != version:
+                snapshot, partial = SHARED.snapshot(latest)
+                SNAPSHOTS.adopt(snapshot, partial)
+                EVENTS.publish('snapshot', snapshot_event(snapshot, partial=partial))
+                version = latest
+        except Exception as e:
+            print(f"  Could not follow the shared snapshot: {e}")
+        time.sleep(interval)
+
+
+def serve_refresh_requests(interval=SHARED_POLL_INTERVAL):
+    """Worker process: start a refresh whenever a reader asks for one"""
+    _, seen, _ = SHARED.read()
+    while True:
+        time.sleep(interval)
+        try:
+            _, requests, _ = SHARED.read()
+        except Exception as e:
+            print(f"  Could not read refresh requests: {e}")
+            continue
+        if requests != seen:
+            seen = requests
+            REFRESH.start(fetch_stock_data)
+
+
+def snapshot_event(snapshot, partial=False):
+    """Payload announcing a published snapshot"""
+    return {"version": snapshot.version, "etag": snapshot.etag,
+            "lastUpdated": snapshot.data.get("lastUpdated"), "partial": partial}
+
+
+class TreemapServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """HTTP server that hands each connection to a fixed pool of worker threads"""
+    
+    allow_reuse_address = True
+    request_queue_size = 256
+    
+    def __init__(self, server_address, handler_class, workers=WORKERS):
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='http')
+        self.detached = set()
+        self.detached_lock = threading.Lock()
+        super().__init__(server_address, handler_class)
+    
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_request_thread, request, client_address)
+    
+    def detach(self, request):
+        """Keep `request` open after its handler returns; the caller now owns it"""
+        with self.detached_lock:
+            self.detached.add(request)
+    
+    def shutdown_request(self, request):
+        with self.detached_lock:
+            if request in self.detached:
+                self.detached.discard(request)
+                return
+        super().shutdown_request(request)
+    
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+def route_label(path):
+    """The /api/metrics route label for a request path"""
+    if path.startswith('/api/history/sector'):
+        return '/api/history/sector'
+    return path if path in ROUTES else 'static'
 
 
 class Handler(http.server.SimpleHTTPRequestHandler):
+    # Keep connections open between requests; idle ones are dropped after
+    # KEEPALIVE_TIMEOUT so they don't tie up a worker
+    protocol_version = 'HTTP/1.1'
+    timeout = KEEPALIVE_TIMEOUT
+    # Headers and body go out in separate writes; with Nagle on, the body of
+    # every request after the first on a connection waits ~40 ms for the
+    # client's delayed ACK
+    disable_nagle_algorithm = True
+
     def do_GET(self):
         parsed = urlparse(self.path)
         
-        if parsed.path == '/api/refresh':
-            self.handle_refresh()
-        elif parsed.path == '/api/status':
-            self.handle_status()
-        else:
-            super().do_GET()
+        with self.measure(parsed.path):
+            if parsed.path == '/api/refresh':
+                self.handle_refresh()
+            elif parsed.path == '/api/status':
+                self.handle_status()
+            elif parsed.path == '/api/events':
+                self.handle_events()
+            elif parsed.path == '/api/data':
+                self.handle_data(parse_qs(parsed.query))
+            elif parsed.path == '/api/history':
+                self.handle_history(parse_qs(parsed.query))
+            elif parsed.path.startswith('/api/history/sector'):
+                self.handle_sector_history(parsed)
+            elif parsed.path == '/api/metrics':
+                self.handle_metrics()
+            elif parsed.path == '/api/movers':
+                self.handle_movers(parse_qs(parsed.query))
+            elif parsed.path == '/api/search':
+                self.handle_search(parse_qs(parsed.query))
+            elif parsed.path == '/api/sectors':
+                self.handle_sectors()
+            elif parsed.path == '/api/layout':
+                self.handle_layout(parse_qs(parsed.query))
+            elif parsed.path == '/' + DATA_FILE and SNAPSHOTS.current():
+                self.handle_snapshot()
+            else:
+                super().do_GET()
+    
+    def do_HEAD(self):
+        parsed = urlparse(self.path)
+        
+        with self.measure(parsed.path):
+            if parsed.path == '/' + DATA_FILE and SNAPSHOTS.current():
+                self.handle_snapshot(head=True)
+            else:
+                super().do_HEAD()
+    
+    @contextmanager
+    def measure(self, path):
+        """Record latency, status and body size of the request being handled"""
+        route = route_label(path)
+        self.response_status = 0
+        self.response_length = 0
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            HTTP_SECONDS.observe(time.perf_counter() - start, route=route)
+            HTTP_REQUESTS.inc(route=route, status=self.response_status)
+            if self.command != 'HEAD':
+                HTTP_BYTES.inc(self.response_length, route=route)
+    
+    def send_response(self, code, message=None):
+        self.response_status = code
+        super().send_response(code, message)
+    
+    def send_header(self, keyword, value):
+        if keyword.lower() == 'content-length':
+            self.response_length = int(value)
+        super().send_header(keyword, value)
     
     def send_json(self, data, status=200):
+        body = json.dumps(data).encode()
         self.send_response(status)
         self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
         self.send_header('Access-Control-Allow-Origin', '*')
         self.end_headers()
-        self.wfile.write(json.dumps(data).encode())
+        self.wfile.write(body)
     
     def handle_refresh(self):
-        """Start a data refresh in background thread"""
-        if refresh_status["is_refreshing"]:
-            self.send_json({"status": "already_running", "message": "Refresh already in progress"})
+        """Start a data refresh in background thread, or join the one in flight"""
+        if SHARED_READER:
+            # The worker process does the fetching
+            if refresh_status["is_refreshing"]:
+                self.send_json({"status": "already_running", "message": "Refresh already in progress"})
+            else:
+                SHARED.request_refresh()
+                # Show it as running here until the worker's own status takes
+                # over, so /api/status doesn't report the old idle state meanwhile
+                update_status(is_refreshing=True, progress=0, message="Refresh requested...")
+                self.send_json({"status": "started", "message": "Refresh requested"})
             return
         
-        # Start refresh in background
-        thread = threading.Thread(target=fetch_stock_data)
-        thread.daemon = True
-        thread.start()
+        if not REFRESH.start(fetch_stock_data):
+            self.send_json({"status": "already_running", "message": "Refresh already in progress"})
+            return
         
         self.send_json({"status": "started", "message": "Refresh started"})
     
+    def handle_snapshot(self, head=False):
+        """
+        Serve the in-memory snapshot, columnar when the Accept header asks for
+        it, gzipped when accepted, with ETag revalidation
+        """
+        snapshot = SNAPSHOTS.current()
+        use_columnar = accepts_columnar(self.headers.get('Accept'))
+        use_gzip = accepts_gzip(self.headers.get('Accept-Encoding'))
+        body, etag = snapshot.variant(use_columnar, use_gzip)
+        
+        if snapshot.matches(self.headers.get('If-None-Match'), etag):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('Vary', 'Accept, Accept-Encoding')
+            self.end_headers()
+            return
+        
+        self.send_response(200)
+        self.send_header('Content-Type', COLUMNAR_CONTENT_TYPE if use_columnar else 'application/json')
+        if use_gzip:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Vary', 'Accept, Accept-Encoding')
+        self.send_header('X-Snapshot-Version', str(snapshot.version))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+    
+    def handle_data(self, query):
+        """
+        Return changes since ?since=<version>, or the full snapshot if that
+        version is gone. ?horizon=1W|1M|3M|YTD returns the full snapshot with
+        change measured over that horizon instead of since the previous close.
+        """
+        if not SNAPSHOTS.current():
+            self.send_json({"error": "no data yet"}, status=503)
+            return
+        
+        try:
+            since = int(query['since'][0]) if 'since' in query else None
+        except ValueError:
+            self.send_json({"error": "since must be a snapshot version"}, status=400)
+            return
+        
+        horizon = query.get('horizon', [DAY])[0].upper()
+        if horizon != DAY and horizon not in HORIZONS:
+            self.send_json({"error": f"horizon must be one of {', '.join((DAY,) + HORIZONS)}"}, status=400)
+            return
+        
+        if horizon == DAY:
+            body = SNAPSHOTS.changes_since(since)
+        else:
+            body = SNAPSHOTS.current().horizon_body(horizon, HORIZON_CLOSES.references)
+            if body is None:
+                self.send_json({"error": "horizon data not available until the next full refresh"}, status=503)
+                return
+        use_gzip = len(body) > 1024 and accepts_gzip(self.headers.get('Accept-Encoding'))
+        if use_gzip:
+            body = gzip.compress(body, compresslevel=6, mtime=0)
+        
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        if use_gzip:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def handle_history(self, query):
+        """Price, change and marketCap of ?ticker= between ?from= and ?to="""
+        if HISTORY is None:
+            self.send_json({"error": "history is not enabled"}, status=404)
+            return
+        ticker = query.get('ticker', [''])[0].upper()
+        try:
+            start = parse_time(query.get('from', [None])[0])
+            end = parse_time(query.get('to', [None])[0])
+        except ValueError:
+            self.send_json({"error": "from/to must be epoch seconds or ISO 8601"}, status=400)
+            return
+        
+        result = HISTORY.ticker_history(ticker, start, end)
+        if result is None:
+            self.send_json({"error": f"no history for {ticker!r}"}, status=404)
+            return
+        self.send_json(result)
+    
+    def handle_sector_history(self, parsed):
+        """Cap-weighted sector change over time: /api/history/sector=NAME or /api/history/sector?name=NAME"""
+        if HISTORY is None:
+            self.send_json({"error": "history is not enabled"}, status=404)
+            return
+        query = parse_qs(parsed.query)
+        rest = parsed.path[len('/api/history/sector'):]
+        sector = unquote(rest[1:]) if rest.startswith('=') else query.get('name', [''])[0]
+        try:
+            start = parse_time(query.get('from', [None])[0])
+            end = parse_time(query.get('to', [None])[0])
+        except ValueError:
+            self.send_json({"error": "from/to must be epoch seconds or ISO 8601"}, status=400)
+            return
+        
+        result = HISTORY.sector_history(sector, start, end)
+        if result is None:
+            self.send_json({"error": f"no history for sector {sector!r}", "sectors": HISTORY.sectors()},
+                           status=404)
+            return
+        self.send_json(result)
+    
+    def query_limit(self, query, default):
+        """?limit= clamped to 1..MAX_LIMIT, or None after sending a 400"""
+        try:
+            return max(1, min(MAX_LIMIT, int(query.get('limit', [default])[0])))
+        except ValueError:
+            self.send_json({"error": "limit must be a number"}, status=400)
+            return None
+    
+    def handle_movers(self, query):
+        """Top ?type=gainers|losers by change, up to ?limit="""
+        snapshot = SNAPSHOTS.current()
+        if not snapshot:
+            self.send_json({"error": "no data yet"}, status=503)
+            return
+        type = query.get('type', ['gainers'])[0]
+        if type not in ('gainers', 'losers'):
+            self.send_json({"error": "type must be gainers or losers"}, status=400)
+            return
+        limit = self.query_limit(query, 10)
+        if limit is None:
+            return
+        self.send_json({"version": snapshot.version, "type": type,
+                        "stocks": snapshot.index().movers(type, limit)})
+    
+    def handle_search(self, query):
+        """Stocks whose ticker or name starts with ?q="""
+        snapshot = SNAPSHOTS.current()
+        if not snapshot:
+            self.send_json({"error": "no data yet"}, status=503)
+            return
+        limit = self.query_limit(query, 8)
+        if limit is None:
+            return
+        q = query.get('q', [''])[0]
+        self.send_json({"version": snapshot.version, "q": q,
+                        "stocks": snapshot.index().search(q, limit)})
+    
+    def handle_sectors(self):
+        """Cap-weighted change, total market cap and breadth of every sector"""
+        snapshot = SNAPSHOTS.current()
+        if not snapshot:
+            self.send_json({"error": "no data yet"}, status=503)
+            return
+        self.send_json({"version": snapshot.version, "sectors": snapshot.index().sectors})
+    
+    def handle_layout(self, query):
+        """Treemap rectangles and label sizes for a ?width= x ?height= viewport"""
+        snapshot = SNAPSHOTS.current()
+        if not snapshot:
+            self.send_json({"error": "no data yet"}, status=503)
+            return
+        try:
+            width = int(query['width'][0])
+            height = int(query['height'][0])
+        except (KeyError, ValueError):
+            self.send_json({"error": "width and height must be numbers"}, status=400)
+            return
+        
+        body, gzip_body = LAYOUTS.get(snapshot, width, height)
+        use_gzip = accepts_gzip(self.headers.get('Accept-Encoding'))
+        if use_gzip:
+            body = gzip_body
+        
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        if use_gzip:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('X-Snapshot-Version', str(snapshot.version))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def handle_metrics(self):
+        """Counters, gauges and histograms in the Prometheus text format"""
+        body = METRICS.render()
+        self.send_response(200)
+        self.send_header('Content-Type', METRICS_CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body)
+    
     def handle_status(self):
         """Return current refresh status"""
         self.send_json(refresh_status)
     
+    def handle_events(self):
+        """Subscribe to refresh progress and snapshot events (Server-Sent Events)"""
+        if not hasattr(self.server, 'detach'):
+            self.send_json({"error": "events need the threaded server"}, status=501)
+            return
+        
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.flush()
+        self.close_connection = True
+        
+        # Start the stream with the current state, then hand the socket over
+        initial = b'retry: 3000\n\n' + format_event('progress', refresh_status)
+        snapshot = SNAPSHOTS.current()
+        if snapshot:
+            initial += format_event('snapshot', snapshot_event(snapshot))
+        self.server.detach(self.connection)
+        EVENTS.subscribe(self.connection, initial)
+    
     def log_message(self, format, *args):
         # Only log API calls
-        if '/api/' in args[0]:
+        if args and '/api/' in str(args[0]):
             print(f"[{datetime.now().strftime('%H:%M:%S')}] {args[0]}")
 
 
 if __name__ == '__main__':
-    with socketserver.TCPServer(("", PORT), Handler) as httpd:
+    parser = argparse.ArgumentParser(description="S&P 500 Treemap Server")
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--provider', default='yfinance',
+                        help="quote source: yfinance, replay:DIR or synthetic[:N]")
+    parser.add_argument('--workers', type=int, default=WORKERS,
+                        help="connections served at once (idle keep-alive connections count too)")
+    parser.add_argument('--refresh-interval', type=float, default=OPEN_INTERVAL,
+                        help="seconds between automatic refreshes in market hours (0 disables)")
+    parser.add_argument('--closed-interval', type=float, default=CLOSED_INTERVAL,
+                        help="longest wait between automatic refreshes while the market is closed")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                        help="tickers per download batch during a refresh")
+    parser.add_argument('--live', action='store_true',
+                        help="between daily full refreshes, poll only the newest 1m bar in market hours")
+    parser.add_argument('--live-interval', type=float, default=LIVE_INTERVAL,
+                        help="seconds between live updates (replaces --refresh-interval with --live)")
+    parser.add_argument('--universe', default=UNIVERSE_FILE,
+                        help="sector,ticker,name CSV of the stocks to track")
+    parser.add_argument('--history-dir', default=HISTORY_DIR,
+                        help="where snapshot history is kept ('' disables it)")
+    parser.add_argument('--shared', nargs='?', const=SHARED_DIR, metavar='DIR',
+                        help=f"share snapshots and refresh status with other processes through DIR "
+                             f"(default {SHARED_DIR})")
+    parser.add_argument('--role', choices=['worker', 'reader'], default='worker',
+                        help="with --shared: the worker refreshes, readers only serve what it publishes")
+    parser.add_argument('--processes', type=int, default=1,
+                        help="serve on one port from this process (the worker) plus readers, "
+                             "this many in all (implies --shared)")
+    parser.add_argument('--parent-pid', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    PORT = args.port
+    PARENT_PID = args.parent_pid
+    if args.processes > 1 and not args.shared:
+        args.shared = SHARED_DIR
+    if args.shared:
+        SHARED = SharedSegment(args.shared)
+        SHARED_READER = args.role == 'reader'
+        # Every process binds the same port and the kernel spreads connections across them
+        TreemapServer.allow_reuse_port = True
+    
+    UNIVERSE = Universe.load(args.universe)
+    HORIZON_CLOSES = HorizonCloses(UNIVERSE)
+    if SHARED_READER:
+        threading.Thread(target=follow_worker, daemon=True).start()
+    else:
+        PROVIDER = make_provider(args.provider)
+        CHUNK_SIZE = args.chunk_size
+        if SHARED is not None:
+            # Carry on from the last shared version so readers see versions keep increasing
+            try:
+                version = SHARED.read()[0]
+                if version:
+                    SNAPSHOTS.adopt(SHARED.snapshot(version)[0])
+            except (OSError, ValueError):
+                pass
+        snapshot = SNAPSHOTS.load(DATA_FILE)
+        if SHARED is not None:
+            if snapshot:
+                SHARED.publish(snapshot)
+            SHARED.write_status(refresh_status)
+            threading.Thread(target=serve_refresh_requests, daemon=True).start()
+        if args.history_dir:
+            HISTORY = HistoryStore(args.history_dir)
+        if args.live:
+            LIVE = LiveQuotes()
+        
+        open_interval = args.live_interval if args.live else args.refresh_interval
+        if open_interval > 0:
+            RefreshScheduler(REFRESH, open_interval, args.closed_interval).start()
+    
+    readers = [
+        subprocess.Popen([sys.executable, os.path.abspath(__file__), '--port', str(PORT),
+                          '--workers', str(args.workers), '--shared', args.shared, '--role', 'reader',
+                          '--universe', args.universe,
+                          '--parent-pid', str(os.getpid())])
+        for _ in range(args.processes - 1)
+    ]
+    
+    with TreemapServer(("", PORT), Handler, workers=args.workers) as httpd:
         print(f"\n  S&P 500 Treemap Server")
         print(f"  ======================")
         print(f"  Open: http://localhost:{PORT}")
+        if SHARED is not None:
+            print(f"  Shared {'reader' if SHARED_READER else 'worker'} on {args.shared}"
+                  + (f" with {len(readers)} readers" if readers else ""))
         print(f"  Press Ctrl+C to stop\n")
         try:
             httpd.serve_forever()
         except KeyboardInterrupt:
             print("\nServer stopped")
+        finally:
+            for reader in readers:
+                reader.terminate()
@@ -0,0 +1,184 @@
+"""
+Snapshots and refresh status shared between server processes.
+
+In shared mode one worker process refreshes the data and writes each
+published snapshot's encoded bodies to its own file in a shared directory
+(on /dev/shm where there is one). Reader processes mmap those files and
+serve straight from the mapping. A file is never changed once it is
+renamed into place, and unlinking it when it ages out leaves existing
+mappings valid, so a reader never sees a torn body.
+
+A small fixed-size control file, also mmapped, holds the current snapshot
+version and the worker's refresh status behind a sequence lock. Readers
+retry if the sequence number is odd or changes under them. It also holds a
+counter readers bump to ask the worker for a refresh. Writers serialize on
+an flock of the control file, which the OS releases if a writer dies.
+
+Control file layout (little-endian):
+    0   b'TMSH'
+    4   uint32 layout version
+    8   uint64 sequence (odd while a write is in progress)
+    16  uint64 current snapshot version (0 = none yet)
+    24  uint64 refresh requests
+    32  uint32 status length
+    64  status JSON
+"""
+
+import json
+import mmap
+import os
+import struct
+import tempfile
+import time
+from contextlib import contextmanager
+
+from snapshot import Snapshot
+
+SHARED_DIR = os.path.join('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(),
+                          'sp500-treemap')
+
+CONTROL_FILE = "control"
+CONTROL_SIZE = 64 * 1024
+CONTROL_MAGIC = b'TMSH'
+LAYOUT_VERSION = 1
+HEADER = struct.Struct('<4sIQQQI')
+SEQUENCE = struct.Struct('<Q')
+SEQUENCE_OFFSET = 8
+STATUS_OFFSET = 64
+
+SNAPSHOT_MAGIC = b'TMSS'
+
+# Snapshot files kept in the directory; readers keep older ones mapped as long as they need them
+SNAPSHOT_KEEP = 8
+
+# Encoded bodies stored per snapshot, in file order
+SECTIONS = ('body', 'gzip_body', 'columnar_body', 'columnar_gzip_body')
+
+# Seconds between checks of the control file for new versions, status or refresh requests
+POLL_INTERVAL = 0.1
+
+
+class SharedSegment:
+    """The control file and snapshot files of one shared directory"""
+
+    def __init__(self, directory=SHARED_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._fd = os.open(os.path.join(directory, CONTROL_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+        with self._locked():
+            if os.fstat(self._fd).st_size < CONTROL_SIZE:
+                os.ftruncate(self._fd, CONTROL_SIZE)
+            self._map = mmap.mmap(self._fd, CONTROL_SIZE)
+            if self._map[:4] != CONTROL_MAGIC:
+                HEADER.pack_into(self._map, 0, CONTROL_MAGIC, LAYOUT_VERSION, 0, 0, 0, 0)
+            elif HEADER.unpack_from(self._map)[1] != LAYOUT_VERSION:
+                raise ValueError(f"{directory} was created by an incompatible version")
+
+    @contextmanager
+    def _locked(self):
+        import fcntl  # POSIX only, like the shared mode itself
+
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _sequence(self):
+        return SEQUENCE.unpack_from(self._map, SEQUENCE_OFFSET)[0]
+
+    def _update(self, version=None, requests=None, status=None):
+        """Change some control fields under the lock, bracketed by odd/even sequence numbers"""
+        with self._locked():
+            _, _, sequence, old_version, old_requests, status_length = HEADER.unpack_from(self._map)
+            sequence += sequence % 2  # a writer that died mid-update left it odd
+            SEQUENCE.pack_into(self._map, SEQUENCE_OFFSET, sequence + 1)
+            if status is not None:
+                encoded = json.dumps(status).encode()
+                if len(encoded) > CONTROL_SIZE - STATUS_OFFSET:
+                    raise ValueError("refresh status too large for the control file")
+                self._map[STATUS_OFFSET:STATUS_OFFSET + len(encoded)] = encoded
+                status_length = len(encoded)
+            HEADER.pack_into(self._map, 0, CONTROL_MAGIC, LAYOUT_VERSION, sequence + 1,
+                             old_version if version is None else version,
+                             old_requests if requests is None else requests(old_requests),
+                             status_length)
+            SEQUENCE.pack_into(self._map, SEQUENCE_OFFSET, sequence + 2)
+
+    def read(self):
+        """(current version, refresh requests, status dict or None), consistent across a concurrent write"""
+        for attempt in range(1000):
+            sequence = self._sequence()
+            if sequence % 2 == 0:
+                _, _, _, version, requests, status_length = HEADER.unpack_from(self._map)
+                status = bytes(self._map[STATUS_OFFSET:STATUS_OFFSET + status_length])
+                if self._sequence() == sequence:
+                    return version, requests, json.loads(status) if status else None
+            time.sleep(0 if attempt < 100 else 0.001)
+
+        # Still odd: the writer died mid-update; wait for the lock and repair it
+        self._update()
+        return self.read()
+
+    def write_status(self, status):
+        """Publish the worker's refresh status"""
+        self._update(status=status)
+
+    def request_refresh(self):
+        """Ask the worker for a refresh"""
+        self._update(requests=lambda n: n + 1)
+
+    def _snapshot_path(self, version):
+        return os.path.join(self.directory, f"snapshot-{version:012d}.bin")
+
+    def publish(self, snapshot, partial=False):
+        """Write `snapshot`'s bodies to an immutable file and make it the current version"""
+        bodies = [getattr(snapshot, name) for name in SECTIONS]
+        sections = []
+        offset = 0
+        for name, body in zip(SECTIONS, bodies):
+            sections.append([name, offset, len(body)])
+            offset += len(body)
+        header = json.dumps({
+            "version": snapshot.version,
+            "digest": snapshot.digest,
+            "created": snapshot.created,
+            "partial": partial,
+            "references": snapshot.references,
+            "sections": sections
+        }).encode()
+
+        path = self._snapshot_path(snapshot.version)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(SNAPSHOT_MAGIC + struct.pack('<I', len(header)) + header)
+            for body in bodies:
+                f.write(body)
+        os.replace(tmp, path)
+        self._update(version=snapshot.version)
+
+        names = sorted(n for n in os.listdir(self.directory) if n.startswith('snapshot-') and n.endswith('.bin'))
+        for name in names[:-SNAPSHOT_KEEP]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def snapshot(self, version):
+        """
+        (Snapshot, partial) published as `version`, its bodies served
+        straight from a read-only mapping of the file
+        """
+        with open(self._snapshot_path(version), 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mapped)
+        if view[:4] != SNAPSHOT_MAGIC:
+            raise ValueError(f"snapshot {version} is damaged")
+        header_length, = struct.unpack_from('<I', view, 4)
+        start = 8 + header_length
+        header = json.loads(bytes(view[8:start]))
+        bodies = {name: view[start + offset:start + offset + length]
+                  for name, offset, length in header['sections']}
+        snapshot = Snapshot.from_encoded(header['version'], header['digest'], header['created'],
+                                         header['references'], **bodies)
+        return snapshot, header['partial']
@@ -0,0 +1,269 @@
+"""
+In-memory snapshot of the latest dataset, pre-serialized for serving.
+
+Each refresh publishes a new Snapshot holding compact JSON bytes, the same
+data in the columnar encoding (see columnar.py), gzip variants of both and
+strong ETags for all four, numbered with an increasing version. Versions
+start from the store's creation time in milliseconds, so they don't repeat
+across server restarts.
+Readers grab the current snapshot with a single reference read, so a
+refresh swapping it in never exposes a partial dataset. A short ring of
+recent snapshots lets clients fetch only what changed since their version;
+partial snapshots published mid-refresh stay out of it, so one refresh
+can't push out the versions clients are catching up from.
+Each snapshot also carries the horizon reference closes of the day (see
+horizons.py) and builds its 1W/1M/3M/YTD views on first request.
+"""
+
+import gzip
+import hashlib
+import json
+import threading
+import time
+from collections import deque
+
+import columnar
+from indexes import SnapshotIndex
+from horizons import horizon_views
+from pipeline import read_output
+
+# Number of recent snapshots kept so clients can ask for changes since one
+HISTORY_SIZE = 32
+
+# Per-ticker fields compared when computing a delta
+DELTA_FIELDS = ('price', 'change', 'marketCap')
+
+
+class Snapshot:
+    """One published dataset with its serialized and compressed bodies"""
+
+    def __init__(self, data, version=0, references=None):
+        body = json.dumps(data, separators=(',', ':')).encode()
+        columnar_body = columnar.encode(data)
+        self._setup(version, hashlib.sha256(body).hexdigest()[:32], time.time(), references,
+                    body, gzip.compress(body, compresslevel=6, mtime=0),
+                    columnar_body, gzip.compress(columnar_body, compresslevel=6, mtime=0))
+        self._data = data
+
+    @classmethod
+    def from_encoded(cls, version, digest, created, references, body, gzip_body, columnar_body,
+                     columnar_gzip_body):
+        """
+        A snapshot around bodies encoded elsewhere, such as memoryviews of a
+        shared file (see shared.py); the dataset is parsed on first use
+        """
+        snapshot = cls.__new__(cls)
+        snapshot._setup(version, digest, created, references, body, gzip_body, columnar_body,
+                        columnar_gzip_body)
+        return snapshot
+
+    def _setup(self, version, digest, created, references, body, gzip_body, columnar_body,
+               columnar_gzip_body):
+        self.version = version
+        self.digest = digest
+        self.created = created
+        self.references = references or {}
+        self.body = body
+        self.gzip_body = gzip_body
+        self.columnar_body = columnar_body
+        self.columnar_gzip_body = columnar_gzip_body
+        self.etag = f'"{digest}"'
+        self.gzip_etag = f'"{digest}-gz"'
+        self.columnar_etag = f'"{digest}-col"'
+        self.columnar_gzip_etag = f'"{digest}-col-gz"'
+        self._data = None
+        self._stocks = None
+        self._deltas = {}  # older version -> encoded delta
+        self._index = None
+        self._horizons = None  # horizon -> encoded /api/data response
+
+    @property
+    def data(self):
+        """The dataset tree"""
+        if self._data is None:
+            self._data = json.loads(bytes(self.body))
+        return self._data
+
+    @property
+    def stocks(self):
+        """{ticker: (sector name, stock)}"""
+        if self._stocks is None:
+            self._stocks = {
+                stock['ticker']: (sector['name'], stock)
+                for sector in self.data.get('children', [])
+                for stock in sector.get('children', [])
+            }
+        return self._stocks
+
+    def index(self):
+        """Movers, search and sector indexes for this dataset, built on first use"""
+        if self._index is None:
+            self._index = SnapshotIndex(self.data)
+        return self._index
+
+    def variant(self, use_columnar=False, use_gzip=False):
+        """(body, etag) of the requested encoding"""
+        if use_columnar:
+            if use_gzip:
+                return self.columnar_gzip_body, self.columnar_gzip_etag
+            return self.columnar_body, self.columnar_etag
+        if use_gzip:
+            return self.gzip_body, self.gzip_etag
+        return self.body, self.etag
+
+    def full_body(self):
+        """The whole dataset wrapped as an /api/data response"""
+        return b'{"version":%d,"full":true,"data":%s}' % (self.version, self.body)
+
+    def horizon_body(self, horizon, references=None):
+        """
+        The dataset with `change` measured over `horizon` (see horizons.py) as
+        an /api/data response, or None without reference closes. `references`
+        is used when the snapshot carries none of its own (one loaded at
+        startup, before any refresh). Every horizon is computed together on
+        first use.
+        """
+        references = self.references or references
+        if not references:
+            return None
+        if self._horizons is None:
+            self._horizons = {
+                h: b'{"version":%d,"full":true,"horizon":"%s","data":%s}' % (
+                    self.version, h.encode(), json.dumps(view, separators=(',', ':')).encode())
+                for h, view in horizon_views(self.data, references).items()
+            }
+        return self._horizons.get(horizon)
+
+    def delta_body(self, older):
+        """
+        An /api/data response listing what changed since `older`, or None if
+        the ticker set itself changed and a full snapshot is needed.
+        """
+        cached = self._deltas.get(older.version)
+        if cached is not None:
+            return cached
+        if self.stocks.keys() != older.stocks.keys():
+            return None
+
+        changes = []
+        for ticker, (sector, stock) in self.stocks.items():
+            previous = older.stocks[ticker][1]
+            if any(stock.get(f) != previous.get(f) for f in DELTA_FIELDS):
+                change = {"ticker": ticker, "sector": sector}
+                change.update((f, stock.get(f)) for f in DELTA_FIELDS)
+                changes.append(change)
+
+        old_indices = older.data.get("indices", {})
+        indices = {k: v for k, v in self.data.get("indices", {}).items() if old_indices.get(k) != v}
+
+        delta = {
+            "version": self.version,
+            "since": older.version,
+            "full": False,
+            "lastUpdated": self.data.get("lastUpdated"),
+            "indices": indices,
+            "changes": changes
+        }
+        body = json.dumps(delta, separators=(',', ':')).encode()
+        self._deltas[older.version] = body
+        return body
+
+    def matches(self, if_none_match, etag):
+        """
+        Whether an If-None-Match header names `etag`, the ETag of the variant
+        being served. Another variant's ETag doesn't count: its bytes aren't
+        a valid cached copy of this one.
+        """
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == '*':
+            return True
+        tags = [t.strip() for t in if_none_match.split(',')]
+        tags = [t[2:] if t.startswith('W/') else t for t in tags]
+        return etag in tags
+
+
+class SnapshotStore:
+    """Holds the current Snapshot and swaps in new ones"""
+
+    def __init__(self, history_size=HISTORY_SIZE):
+        self._current = None
+        # Count on from the start time, so a client still holding a version
+        # from before a restart never gets a delta against an unrelated
+        # snapshot that happens to have the same number
+        self._version = int(time.time() * 1000)
+        self._history = deque(maxlen=history_size)
+        self._lock = threading.Lock()
+
+    def current(self):
+        """The latest Snapshot, or None if nothing has been published"""
+        return self._current
+
+    def get(self, version):
+        """The current or a recent full Snapshot by version, or None if it has aged out"""
+        current = self._current
+        if current is not None and current.version == version:
+            return current
+        for snapshot in list(self._history):
+            if snapshot.version == version:
+                return snapshot
+        return None
+
+    def changes_since(self, version):
+        """
+        Encoded /api/data response bringing a client at `version` up to date:
+        a delta when `version` is still in the ring, otherwise the full dataset.
+        """
+        current = self._current
+        older = self.get(version) if version is not None else None
+        if older is not None:
+            body = current.delta_body(older)
+            if body is not None:
+                return body
+        return current.full_body()
+
+    def publish(self, data, references=None, partial=False):
+        """
+        Serialize `data` and make it the current snapshot, numbered one past
+        the last. Horizon reference closes carry over from the current
+        snapshot unless new ones are given. A partial snapshot isn't kept
+        in the delta ring once it's replaced.
+        """
+        with self._lock:
+            if references is None and self._current is not None:
+                references = self._current.references
+            self._version += 1
+            snapshot = Snapshot(data, self._version, references)
+            if not partial:
+                self._history.append(snapshot)
+            self._current = snapshot
+        return snapshot
+
+    def adopt(self, snapshot, partial=False):
+        """Make a snapshot built elsewhere (another process) current, keeping its version"""
+        with self._lock:
+            self._version = max(self._version, snapshot.version)
+            if not partial:
+                self._history.append(snapshot)
+            self._current = snapshot
+        return snapshot
+
+    def load(self, path, references=None):
+        """
+        Publish the dataset saved at `path`, or the newest good copy of it if
+        the file is damaged (see pipeline.read_output), if there is one
+        """
+        data = read_output(path)
+        if data is None:
+            return None
+        return self.publish(data, references)
+
+
+def accepts_gzip(accept_encoding):
+    """Whether an Accept-Encoding header allows a gzip response"""
+    for part in (accept_encoding or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        if coding.strip().lower() in ('gzip', '*'):
+            params = params.replace(' ', '')
+            return params not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000')
+    return False
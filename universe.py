@@ -0,0 +1,67 @@
+"""
+The stock universe: every constituent's ticker, name and sector, loaded from
+one CSV file (sp500_universe.csv) shared by server.py and fetch_data.py.
+
+Universe indexes the constituents by ticker, yfinance symbol and sector so
+lookups are dict hits, and keeps the {sector: [(ticker, name), ...]} shape
+the pipeline stages take.
+"""
+
+import csv
+import os
+
+from pipeline import to_yf_ticker
+
+UNIVERSE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sp500_universe.csv")
+
+# Also fetch index data
+INDICES = ["SPY", "QQQ"]
+
+
+class Universe:
+    """Constituents by sector, indexed by ticker, yfinance symbol and sector"""
+
+    def __init__(self, stocks, indices=INDICES):
+        self.stocks = stocks
+        self.indices = list(indices)
+        self.by_ticker = {}  # ticker -> (ticker, name, sector)
+        self.by_symbol = {}  # yfinance symbol -> (ticker, name, sector)
+        for sector, sector_stocks in stocks.items():
+            for ticker, name in sector_stocks:
+                entry = (ticker, name, sector)
+                self.by_ticker[ticker] = entry
+                self.by_symbol[to_yf_ticker(ticker)] = entry
+
+    @classmethod
+    def load(cls, path=UNIVERSE_FILE, indices=INDICES):
+        """Read a sector,ticker,name CSV, keeping the file's order"""
+        stocks = {}
+        with open(path, newline='') as f:
+            for row in csv.DictReader(f):
+                stocks.setdefault(row['sector'], []).append((row['ticker'], row['name']))
+        return cls(stocks, indices)
+
+    def __len__(self):
+        return len(self.by_ticker)
+
+    def __contains__(self, ticker):
+        return ticker in self.by_ticker
+
+    def get(self, ticker):
+        """(ticker, name, sector) for a ticker, or None"""
+        return self.by_ticker.get(ticker)
+
+    def from_symbol(self, symbol):
+        """(ticker, name, sector) for a yfinance symbol such as BRK.B, or None"""
+        return self.by_symbol.get(symbol)
+
+    def sector(self, name):
+        """[(ticker, name), ...] in a sector (empty if unknown)"""
+        return self.stocks.get(name, [])
+
+    def sectors(self):
+        return list(self.stocks)
+
+    def symbols(self):
+        """Every yfinance symbol to download (BRK-B becomes BRK.B), indices last"""
+        return list(self.by_symbol) + self.indices
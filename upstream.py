@@ -0,0 +1,215 @@
+"""
+Client layer for calls to the upstream quote service.
+
+Every Yahoo call made by YFinanceProvider goes through one UpstreamClient,
+which combines three guards:
+
+  RateLimiter      token bucket whose rate halves on each throttle response
+                   and creeps back up while calls succeed (AIMD)
+  retries          transient failures are retried with jittered exponential
+                   backoff
+  CircuitBreaker   after enough consecutive failures calls fail fast for a
+                   cool-down period, then a single probe decides whether to
+                   close it again
+
+A call that still fails raises its last exception (or CircuitOpenError), so
+callers such as market_caps.fetch_market_caps report it per ticker.
+"""
+
+import random
+import threading
+import time
+
+# Starting, lowest and highest upstream calls per second
+RATE = 8.0
+MIN_RATE = 0.5
+MAX_RATE = 50.0
+
+# Calls that may be made back to back before the rate applies
+BURST = 8
+
+# Calls per second added back after each success, and the factor applied on a throttle
+RATE_INCREASE = 0.1
+RATE_DECREASE = 0.5
+
+# Throttles within this many seconds of a rate cut count as the same episode
+DECREASE_INTERVAL = 1.0
+
+# Attempts per call, and the backoff before retry n is uniform in [0, min(MAX_BACKOFF, BASE_BACKOFF * 2**n)]
+ATTEMPTS = 4
+BASE_BACKOFF = 0.5
+MAX_BACKOFF = 8.0
+
+# Consecutive failures that open the circuit, and seconds it stays open
+FAILURE_THRESHOLD = 20
+RESET_TIMEOUT = 30.0
+
+
+class RateLimitError(Exception):
+    """The upstream said to slow down (HTTP 429)"""
+
+
+class CircuitOpenError(Exception):
+    """The circuit breaker is open, so the call was not attempted"""
+
+
+def is_throttle(error):
+    """Whether an exception means we were rate limited"""
+    if isinstance(error, RateLimitError):
+        return True
+    # yfinance raises YFRateLimitError; older versions surface the HTTP error text
+    text = f"{type(error).__name__} {error}".lower()
+    return 'ratelimit' in text or 'rate limit' in text or 'too many requests' in text or '429' in text
+
+
+def is_transient(error):
+    """Whether a failed call is worth retrying"""
+    # ConnectionError, TimeoutError and socket errors are all OSErrors
+    return is_throttle(error) or isinstance(error, OSError)
+
+
+class RateLimiter:
+    """Token bucket that adapts its rate to throttling (additive increase, multiplicative decrease)"""
+
+    def __init__(self, rate=RATE, burst=BURST, min_rate=MIN_RATE, max_rate=MAX_RATE,
+                 increase=RATE_INCREASE, decrease=RATE_DECREASE):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._decreased = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        """Block until a call may be made"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def succeeded(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def throttled(self):
+        """Back off: cut the rate and drop any saved-up burst"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens = min(self._tokens, 0.0)
+            # Calls already in flight when we got throttled fail together;
+            # cut the rate once for them, not once each
+            if now - self._decreased >= DECREASE_INTERVAL:
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+                self._decreased = now
+
+
+class CircuitBreaker:
+    """Fails calls fast after `threshold` consecutive failures, for `reset_timeout` seconds"""
+
+    def __init__(self, threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def state(self):
+        with self._lock:
+            if self.opened_at is None:
+                return 'closed'
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return 'open'
+            return 'half-open'
+
+    def allow(self):
+        """Raise CircuitOpenError unless a call may go ahead"""
+        with self._lock:
+            if self.opened_at is None:
+                return
+            remaining = self.reset_timeout - (time.monotonic() - self.opened_at)
+            if remaining > 0 or self._probing:
+                raise CircuitOpenError(f"upstream circuit open, retrying in {max(remaining, 0):.0f}s")
+            # Half-open: let one probe through
+            self._probing = True
+
+    def succeeded(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def failed(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+
+class UpstreamClient:
+    """Rate-limited, retrying, circuit-broken calls to one upstream service"""
+
+    def __init__(self, limiter=None, breaker=None, attempts=ATTEMPTS, base_backoff=BASE_BACKOFF,
+                 max_backoff=MAX_BACKOFF):
+        self.limiter = limiter or RateLimiter()
+        self.breaker = breaker or CircuitBreaker()
+        self.attempts = attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "retries": 0, "throttled": 0, "failed": 0, "rejected": 0}
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def backoff(self, attempt):
+        """Seconds to wait before retry number `attempt` (full jitter)"""
+        return random.uniform(0, min(self.max_backoff, self.base_backoff * 2 ** attempt))
+
+    def call(self, fn, *args, **kwargs):
+        """fn(*args, **kwargs) under the rate limit, retrying transient failures"""
+        self._count("calls")
+        for attempt in range(self.attempts):
+            try:
+                self.breaker.allow()
+            except CircuitOpenError:
+                self._count("rejected")
+                raise
+            self.limiter.acquire()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                if not is_transient(e):
+                    # The upstream answered; the problem is with this request
+                    self.breaker.succeeded()
+                    self._count("failed")
+                    raise
+                self.breaker.failed()
+                if is_throttle(e):
+                    self._count("throttled")
+                    self.limiter.throttled()
+                if attempt == self.attempts - 1:
+                    self._count("failed")
+                    raise
+                self._count("retries")
+                time.sleep(self.backoff(attempt))
+                continue
+            self.breaker.succeeded()
+            self.limiter.succeeded()
+            return result